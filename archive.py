@@ -0,0 +1,145 @@
+import logging
+import lzma
+import os
+import struct
+import zlib
+from array import array
+from time import time
+
+default_block_frames = 360
+
+ZLIB = 0
+LZMA = 1
+compressors = {ZLIB: (lambda data: zlib.compress(data, 9), zlib.decompress),
+               LZMA: (lzma.compress, lzma.decompress)}
+
+# magic, version, method, frame length, frame count, first time, last time, times size, data size
+block_header = struct.Struct("<4sBBHIddII")
+block_magic = b"PSAB"
+block_version = 1
+
+
+def encode_block(frames: bytes, length: int) -> bytes:
+    # every frame is xored with the one before it, then the bytes are stored column by column, so that
+    # the long zero runs of nearly identical frames end up next to each other
+    previous = bytes(length) + frames[:-length]
+    delta = (int.from_bytes(frames, "big") ^ int.from_bytes(previous, "big")).to_bytes(len(frames), "big")
+    return b"".join(delta[column::length] for column in range(length))
+
+
+def decode_block(columns: bytes, length: int) -> bytearray:
+    count = len(columns) // length
+    delta = bytearray(len(columns))
+    for column in range(length):
+        delta[column::length] = columns[column * count:(column + 1) * count]
+
+    frames = bytearray(len(delta))
+    previous = 0
+    for idx in range(0, len(delta), length):
+        previous ^= int.from_bytes(delta[idx:idx + length], "big")
+        frames[idx:idx + length] = previous.to_bytes(length, "big")
+    return frames
+
+
+class ArchiveWriter:
+    # frames are only written a block at a time, close() writes the blocks that are not full yet
+    def __init__(self, path: str, block_frames: int = default_block_frames, method: int = ZLIB):
+        self.path = path
+        self.blockFrames = block_frames
+        self.method = method
+        # frames are grouped by length, main and optional frames end up in separate blocks
+        self.pending = {}
+
+    def add(self, frame: bytes, timestamp: float = None):
+        (times, frames) = self.pending.setdefault(len(frame), (array("d"), bytearray()))
+        times.append(time() if timestamp is None else timestamp)
+        frames += frame
+        if len(times) >= self.blockFrames:
+            self.write_block(len(frame))
+
+    def on_topic_data(self, kind: str, data: bytes):
+        # the heat pump passes what it decoded: main responses as received, optional responses as the query of
+        # the simulated optional pcb with bytes 4 and 5 of the response merged in (0xF1 0x11, not 0x71 0x11)
+        self.add(data)
+
+    def write_block(self, length: int):
+        (times, frames) = self.pending.pop(length)
+        compress = compressors[self.method][0]
+        first = times[0]
+        offsets = array("q", (round((t - first) * 1000) for t in times))
+        packed_times = compress(offsets.tobytes())
+        packed_frames = compress(encode_block(bytes(frames), length))
+
+        with open(self.path, "ab") as file:
+            file.write(block_header.pack(block_magic, block_version, self.method, length, len(times),
+                                         first, times[-1], len(packed_times), len(packed_frames)))
+            file.write(packed_times)
+            file.write(packed_frames)
+        logging.debug(F"archive: {len(times)} frames of {length} bytes, {len(frames)} -> {len(packed_frames)} bytes")
+
+    def flush(self):
+        for length in list(self.pending):
+            self.write_block(length)
+
+    def close(self):
+        self.flush()
+
+
+class Block:
+    def __init__(self, offset: int, method: int, length: int, count: int, first: float, last: float,
+                 times_size: int, data_size: int):
+        self.offset = offset
+        self.method = method
+        self.length = length
+        self.count = count
+        self.first = first
+        self.last = last
+        self.timesSize = times_size
+        self.dataSize = data_size
+
+    def overlaps(self, since: float, until: float) -> bool:
+        return (since is None or self.last >= since) and (until is None or self.first <= until)
+
+
+class ArchiveReader:
+    def __init__(self, path: str):
+        self.path = path
+        self.blocks = []
+        self.index()
+
+    def index(self):
+        # only the block headers are read, payloads are skipped
+        size = os.path.getsize(self.path)
+        with open(self.path, "rb") as file:
+            while file.tell() + block_header.size <= size:
+                offset = file.tell()
+                (magic, version, method, length, count, first, last, times_size, data_size) = \
+                    block_header.unpack(file.read(block_header.size))
+                if magic != block_magic or version != block_version or \
+                        offset + block_header.size + times_size + data_size > size:
+                    logging.warning(F"archive: invalid or truncated block at {offset} in {self.path}, ignoring the rest")
+                    break
+                self.blocks.append(Block(offset, method, length, count, first, last, times_size, data_size))
+                file.seek(times_size + data_size, os.SEEK_CUR)
+
+    def read_block(self, block: Block) -> (array, bytearray):
+        # timestamps and the frames of a block as one contiguous buffer of count * length bytes
+        decompress = compressors[block.method][1]
+        with open(self.path, "rb") as file:
+            file.seek(block.offset + block_header.size)
+            offsets = array("q")
+            offsets.frombytes(decompress(file.read(block.timesSize)))
+            frames = decode_block(decompress(file.read(block.dataSize)), block.length)
+
+        times = array("d", (block.first + offset / 1000 for offset in offsets))
+        return times, frames
+
+    def read(self, since: float = None, until: float = None, length: int = None):
+        for block in self.blocks:
+            if not block.overlaps(since, until) or (length is not None and block.length != length):
+                continue
+
+            (times, frames) = self.read_block(block)
+            for idx, timestamp in enumerate(times):
+                if (since is None or timestamp >= since) and (until is None or timestamp <= until):
+                    yield timestamp, frames[idx * block.length:(idx + 1) * block.length]
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import timeit
+from itertools import cycle
+
+import topics
+from clock import VirtualClock
+from decoder import read_capture
+
+benchmark_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+default_capture = os.path.join(benchmark_dir, "frames.txt")
+default_baseline = os.path.join(benchmark_dir, "baseline.json")
+default_repeat = 9
+default_tolerance = 0.25
+
+
+class FakeSerial:
+    # answers every write of a poll or command with the next recorded frame of the matching kind
+    def __init__(self, main_frames: [bytes], optional_frames: [bytes]):
+        self.main = cycle(main_frames)
+        self.optional = cycle(optional_frames)
+        self.rx = bytearray()
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self.rx)
+
+    def readinto(self, buffer) -> int:
+        n = min(len(buffer), len(self.rx))
+        buffer[:n] = self.rx[:n]
+        del self.rx[:n]
+        return n
+
+    def write(self, data) -> int:
+        self.rx += next(self.optional if len(data) == 20 else self.main)
+        return len(data)
+
+    def reset_input_buffer(self):
+        self.rx.clear()
+
+    def close(self):
+        pass
+
+
+def load_frames(path: str) -> ([bytes], [bytes]):
+    frames = [frame for (_, frame) in read_capture(path)]
+    return [f for f in frames if len(f) == 203], [f for f in frames if len(f) == 20]
+
+
+def bench_reference(frames: [bytes]):
+    # plain interpreter work that no change of this repository affects, the benchmarks are compared as
+    # multiples of it instead of as absolute rates
+    frames = cycle(frames)
+
+    def run():
+        total = 0
+        for value in next(frames):
+            total = (total + value) & 0xFF
+        return total
+    return run
+
+
+def bench_decode(frames: [bytes]):
+    frames = cycle(frames)
+    return lambda: topics.decode_and_update_topic(next(frames), [])
+
+
+def bench_checksum(frames: [bytes]):
+    frames = cycle([frame[:-1] for frame in frames])
+    return lambda: topics.checksum(next(frames))
+
+
+def bench_to_json():
+    all_topics = cycle(topics.topics)
+    return lambda: next(all_topics).to_json()
+
+
+def bench_find_topic():
+    names = cycle([topic.name for topic in topics.topics])
+    return lambda: topics.find_topic(next(names))
+
+
+def sample_value(topic: topics.Topic) -> str:
+    if topic.area is not None:
+        return str(int(sum(topic.area) // 2))
+    if topic.enum:
+        return topic.enum[-1]
+    return "1"
+
+
+def bench_parse():
+    samples = cycle([(topic, sample_value(topic)) for topic in topics.topics if topic.writable])
+
+    def run():
+        (topic, value) = next(samples)
+        if topic.accepts(value):
+            topic.parse(value)
+    return run
+
+
+def bench_wrap_dbus_value():
+    from ve_utils import wrap_dbus_value
+
+    values = cycle([topic.value for topic in topics.topics])
+    return lambda: wrap_dbus_value(next(values))
+
+
+def bench_loop(main_frames: [bytes], optional_frames: [bytes]):
+    from heatpump import Heatpump
+
+    clock = VirtualClock()
+    heatpump = Heatpump("fake", poll_interval=10, optional_pcb_poll_interval=2, on_topic_received=lambda t: True,
+                        on_topic_data=None, port=FakeSerial(main_frames, optional_frames), clock=clock)
+
+    def run():
+        # one poll written and its answer processed, the scheduler picks main or optional as it would
+        clock.advance(2.5)
+        heatpump.loop()
+        heatpump.loop()
+    return run
+
+
+def calibrate(fnc: any) -> (timeit.Timer, int):
+    timer = timeit.Timer(fnc)
+    (number, _) = timer.autorange()
+    return timer, number
+
+
+def measure(fnc: any, repeat: int, reference: (timeit.Timer, int)) -> dict:
+    # every run is paired with a run of the reference right before it, what slows down the machine for a
+    # moment slows down both, the ratio of the pair stays
+    (timer, number) = calibrate(fnc)
+    rates = []
+    ratios = []
+    for _ in range(repeat):
+        reference_rate = reference[1] / reference[0].timeit(reference[1])
+        rates.append(number / timer.timeit(number))
+        ratios.append(rates[-1] / reference_rate)
+    return {"ops": round(statistics.mean(rates), 1), "stdev": round(statistics.stdev(rates), 1),
+            "min": round(min(rates), 1), "max": round(max(rates), 1),
+            "relative": round(statistics.median(ratios), 4)}
+
+
+def run_benchmarks(capture: str, repeat: int, only: str = None) -> dict:
+    (main_frames, optional_frames) = load_frames(capture)
+    # warm state, so that to_json & co. see decoded values
+    for frame in main_frames + optional_frames:
+        topics.decode_and_update_topic(frame)
+
+    reference = calibrate(bench_reference(main_frames))
+    benchmarks = {
+        "decode_main": lambda: bench_decode(main_frames),
+        "decode_optional": lambda: bench_decode(optional_frames),
+        "checksum": lambda: bench_checksum(main_frames),
+        "to_json": bench_to_json,
+        "find_topic": bench_find_topic,
+        "parse_accepts": bench_parse,
+        "wrap_dbus_value": bench_wrap_dbus_value,
+        "heatpump_loop": lambda: bench_loop(main_frames, optional_frames),
+    }
+
+    results = {}
+    for name, setup in benchmarks.items():
+        if only is not None and only not in name:
+            continue
+        try:
+            fnc = setup()
+        except ImportError as err:
+            logging.warning(F"benchmark: {name} skipped, {err}")
+            continue
+        results[name] = measure(fnc, repeat, reference)
+        r = results[name]
+        logging.info(F"benchmark: {name:16} {r['ops']:12.1f} ops/s ± {r['stdev']:.1f}")
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> [str]:
+    regressions = []
+    for name, r in results.items():
+        reference = baseline.get("results", {}).get(name)
+        if reference is None or "relative" not in reference:
+            continue
+        # rates relative to the reference do not depend on the machine the baseline was recorded on
+        change = r["relative"] / reference["relative"] - 1
+        flag = ""
+        if change < -tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        logging.info(F"benchmark: {name:16} {change:+7.1%} against baseline{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the decode, serialise and dispatch hot paths")
+    parser.add_argument("--capture", default=default_capture, help="recorded frames (<unix time> <hex bytes>)")
+    parser.add_argument("--baseline", default=default_baseline)
+    parser.add_argument("--save", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--repeat", type=int, default=default_repeat)
+    parser.add_argument("--tolerance", type=float, default=default_tolerance,
+                        help="slowdown that counts as regression, 0.25 is 25%%")
+    parser.add_argument("--only", help="run only benchmarks containing this name")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    results = run_benchmarks(args.capture, max(args.repeat, 2), args.only)
+
+    if args.save:
+        with open(args.baseline, "w") as file:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "results": results},
+                      file, indent=2)
+            file.write("\n")
+        logging.info(F"benchmark: baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if compare(results, baseline, args.tolerance):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
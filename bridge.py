@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import signal
+
+from gi.repository import GLib
+
+from archive import ArchiveWriter
+from heatpump import Heatpump
+from historydb import HistoryDatabase
+from httpapi import HttpApi, default_http_port
+from topics import topics
+from metrics import MetricsServer, default_metrics_port
+from shm import SharedState, default_segment_name
+from sinks import QueuedSink, COALESCE, DROP_OLDEST, default_queue_size
+from uds import UdsServer, default_socket_path
+
+
+def main():
+    # one serial connection, decoded once per frame, fanned out to every enabled sink
+    parser = argparse.ArgumentParser(description="Serve the heat pump over MQTT and D-Bus from one serial port")
+    parser.add_argument("--device", default="/dev/ttyUSB0")
+    parser.add_argument("--poll", type=int, default=10, help="seconds between polls, 0 to not poll")
+    parser.add_argument("--optional-poll", type=int, default=2, help="seconds between optional pcb polls, 0 for none")
+    parser.add_argument("--adaptive", type=int, nargs=2, metavar=("MIN", "MAX"), help="adaptive poll interval")
+    parser.add_argument("--listen-only", action="store_true", help="only decode what others on the bus send")
+    parser.add_argument("--mqtt", default="localhost:1883", help="broker host:port, empty to disable")
+    parser.add_argument("--dbus", action="store_true", help="publish on D-Bus as a Venus OS service")
+    parser.add_argument("--queue-size", type=int, default=default_queue_size, help="updates a sink may fall behind")
+    parser.add_argument("--overflow", choices=[COALESCE, DROP_OLDEST], default=COALESCE,
+                        help="what a full sink queue gives up")
+    parser.add_argument("--shm", default=default_segment_name, help="shared memory segment for local readers, "
+                                                                    "empty to disable")
+    parser.add_argument("--uds", default=default_socket_path, help="unix domain socket of the binary API, "
+                                                                   "empty to disable")
+    parser.add_argument("--http-port", type=int, default=default_http_port, help="port of the JSON API, 0 to disable")
+    parser.add_argument("--history-db", help="SQLite file to keep the history of every topic in")
+    parser.add_argument("--archive", help="file to append every decoded frame to, see decoder.py")
+    parser.add_argument("--metrics-port", type=int, default=default_metrics_port, help="0 to disable")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    sinks = []
+    if args.mqtt:
+        from sinks import MqttSink
+
+        (host, _, port) = args.mqtt.partition(":")
+        sinks.append(QueuedSink(MqttSink(host, int(port or 1883)), args.queue_size, args.overflow))
+
+    if args.dbus:
+        from dbus.mainloop.glib import DBusGMainLoop
+        from sinks import DbusSink
+
+        DBusGMainLoop(set_as_default=True)
+        # D-Bus is served from the main loop, updates are delivered in batches whenever it is idle
+        sinks.append(QueuedSink(DbusSink(), args.queue_size, args.overflow, scheduler=GLib.idle_add))
+
+    if args.uds:
+        sinks.append(QueuedSink(UdsServer(args.uds), args.queue_size, args.overflow))
+
+    archive = ArchiveWriter(args.archive) if args.archive else None
+    heatpump = Heatpump(device=args.device,
+                        poll_interval=args.poll,
+                        optional_pcb_poll_interval=args.optional_poll,
+                        on_topic_received=None,
+                        on_topic_data=archive.on_topic_data if archive is not None else None,
+                        adaptive_poll_interval=args.adaptive,
+                        listen_only=args.listen_only)
+    for sink in sinks:
+        heatpump.add_sink(sink)
+
+    shared = None
+    if args.shm:
+        shared = SharedState(topics, args.shm)
+        heatpump.add_listener(shared.record)
+
+    history = None
+    if args.history_db:
+        history = HistoryDatabase(args.history_db)
+        heatpump.add_listener(history.record)
+
+    if args.http_port:
+        heatpump.add_listener(HttpApi(args.http_port).record)
+
+    if args.metrics_port:
+        MetricsServer(args.metrics_port)
+
+    logging.info(F"bridge: serving {', '.join(sink.name for sink in sinks) or 'no sinks'}")
+    GLib.timeout_add(50, heatpump.loop)
+    mainloop = GLib.MainLoop()
+    # sinks and files are closed on a regular stop as well
+    GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGTERM, mainloop.quit)
+    try:
+        mainloop.run()
+    finally:
+        for sink in sinks:
+            sink.close()
+        heatpump.shutdown()
+        if shared is not None:
+            shared.close()
+        if history is not None:
+            history.close()
+        if archive is not None:
+            archive.close()
+
+
+if __name__ == "__main__":
+    main()
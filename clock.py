@@ -0,0 +1,31 @@
+from time import monotonic
+
+# scheduled time that never comes
+NEVER = float("inf")
+
+
+class MonotonicClock:
+    # seconds that only move forward, not affected by NTP steps or DST
+    def now(self) -> float:
+        return monotonic()
+
+    def __call__(self) -> float:
+        return self.now()
+
+
+class VirtualClock(MonotonicClock):
+    # time only moves when told to, for tests and simulations
+    def __init__(self, start: float = 0.0):
+        self.time = start
+
+    def now(self) -> float:
+        return self.time
+
+    def advance(self, seconds: float) -> float:
+        if seconds < 0:
+            raise ValueError(F"Clock cannot go back {-seconds}s.")
+        self.time += seconds
+        return self.time
+
+
+default_clock = MonotonicClock()
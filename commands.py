@@ -0,0 +1,71 @@
+import json
+from itertools import count
+
+from clock import default_clock
+
+SUCCESS = "success"
+FAILURE = "failure"
+TIMEOUT = "timeout"
+
+# trace stages in the order a command passes them
+RECEIVED = "received"
+ENQUEUED = "enqueued"
+WRITTEN = "written"
+RESPONDED = "responded"
+COMPLETED = "completed"
+
+# name -> (from stage, to stage) of the durations that are aggregated per command
+trace_spans = {"validate": (RECEIVED, ENQUEUED),
+               "queue": (ENQUEUED, WRITTEN),
+               "heatpump": (WRITTEN, RESPONDED),
+               "confirm": (RESPONDED, COMPLETED),
+               "total": (RECEIVED, COMPLETED)}
+
+command_ids = count(1)
+
+
+class Command:
+    def __init__(self, topic: any, value: any, received: float = None):
+        self.id = next(command_ids)
+        self.topic = topic
+        self.value = value
+        self.result = None
+        self.polled = False
+        self.deadline = None
+        # stage -> clock time
+        self.times = {RECEIVED: default_clock.now() if received is None else received}
+
+    @property
+    def pending(self) -> bool:
+        return self.result is None
+
+    def mark(self, stage: str, now: float = None) -> float:
+        # only the first time a stage is reached counts
+        return self.times.setdefault(stage, default_clock.now() if now is None else now)
+
+    def spans(self) -> {str: float}:
+        return {name: self.times[end] - self.times[start] for name, (start, end) in trace_spans.items()
+                if start in self.times and end in self.times}
+
+    def trace(self, stage: str) -> dict:
+        return {"id": self.id, "topic": self.topic.name, "value": self.value, "stage": stage,
+                "elapsed": round(self.times[stage] - self.times[RECEIVED], 6), "result": self.result}
+
+    def confirm(self) -> bool:
+        # a frame decoded after the write either carries the requested value, or - if it is the answer to the
+        # priority poll issued for this command - proves that the heat pump did not take it
+        if self.topic.value == self.value:
+            self.result = SUCCESS
+        elif self.polled:
+            self.result = FAILURE
+        return not self.pending
+
+    def __str__(self):
+        return F"#{self.id} {self.topic.name}={self.value} ({self.result or 'pending'})"
+
+    def to_json(self):
+        o = {"id": self.id, "value": self.value, "result": self.result}
+        if self.result == FAILURE:
+            o["actual"] = self.topic.value
+
+        return json.dumps(o)
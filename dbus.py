@@ -1,43 +1,16 @@
 #!/usr/bin/env python3
 
 from gi.repository import GLib
-import platform
 from heatpump import Heatpump
 import logging
-import sys
-import os
 from topics import *
-
-sys.path.insert(1, os.path.join(os.path.dirname(__file__), '../ext/velib_python'))
-from vedbus import VeDbusService
+from veservice import create_service
 
 
 class DbusAquareaService(object):
 
     def __init__(self, servicename, deviceinstance, productname='Aquarea Heatpump', connection='RS485'):
-        self._dbusservice = VeDbusService(servicename)
-        logging.debug("%s /DeviceInstance = %d" % (servicename, deviceinstance))
-
-        # Create the management objects, as specified in the ccgx dbus-api document
-        self._dbusservice.add_path('/Mgmt/ProcessName', __file__)
-        self._dbusservice.add_path('/Mgmt/ProcessVersion',
-                                   'Unkown version, and running on Python ' + platform.python_version())
-        self._dbusservice.add_path('/Mgmt/Connection', connection)
-
-        # Create the mandatory objects
-        self._dbusservice.add_path('/DeviceInstance', deviceinstance)
-        self._dbusservice.add_path('/ProductId', 4711)
-        self._dbusservice.add_path('/ProductName', productname)
-        self._dbusservice.add_path('/FirmwareVersion', 0)
-        self._dbusservice.add_path('/HardwareVersion', 0)
-        self._dbusservice.add_path('/Connected', 1)
-
-        for topic in topics:
-            self._dbusservice.add_path(path=F"/Topic/{topic.name}", value=None,
-                                       description=topic.help,
-                                       writeable=topic.writable,
-                                       onchangecallback=self.on_value_changed if topic.writable else None,
-                                       gettextcallback=self.on_get_text)
+        self._dbusservice = create_service(servicename, deviceinstance, self.on_value_changed, productname, connection)
 
         self.heatpump = Heatpump("/dev/ttyUSB0", 10, 2, self.on_topic_received, None)
 
@@ -57,14 +30,6 @@ class DbusAquareaService(object):
 
         return False
 
-    def on_get_text(self, path: str, value):
-        for topic in topics:
-            if F"/topic/{topic.name.lower()}" == path.lower():
-                return topic.description
-
-        return value
-
-
 
 
 def main():
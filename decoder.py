@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import topics
+from archive import ArchiveReader, block_magic
+from frame import Frame, OPTIONAL_REQUEST, OPTIONAL_RESPONSE, frame_kind, merge_optional_response, \
+    optional_pcb_template
+
+default_chunk_seconds = 86400
+
+
+def is_archive(path: str) -> bool:
+    with open(path, "rb") as file:
+        return file.read(len(block_magic)) == block_magic
+
+
+def read_capture(path: str) -> [(float, bytes)]:
+    # text capture, one frame per line: <unix time> <hex bytes>
+    frames = []
+    with open(path) as file:
+        for line in file:
+            fields = line.split(maxsplit=1)
+            if len(fields) == 2 and not line.startswith("#"):
+                frames.append((float(fields[0]), bytes.fromhex(fields[1])))
+    return frames
+
+
+def chunk_windows(first: float, last: float, seconds: int) -> [(float, float)]:
+    start = first // seconds * seconds
+    windows = []
+    while start <= last:
+        windows.append((start, start + seconds))
+        start += seconds
+    return windows
+
+
+def frame_topics(length: int) -> [topics.Topic]:
+    registry = topics.registry
+    return registry.partition(length) + [topic for group in registry.static_partition(length).values()
+                                         for topic in group]
+
+
+def decode_frames(frames: [(float, bytes)]) -> {str: [(float, any)]}:
+    topics.reset_topics()
+    # the service archives optional frames as the merged query of the simulated optional pcb, those decode as
+    # they are. Raw responses of a bus capture are merged into the last query seen, as the service does.
+    optional_query = Frame(20, optional_pcb_template)
+    rows = {}
+    started = set()
+    for (timestamp, frame) in sorted(frames, key=lambda f: f[0]):
+        kind = frame_kind(frame)
+        if kind == OPTIONAL_RESPONSE:
+            frame = merge_optional_response(optional_query, frame)
+        elif kind == OPTIONAL_REQUEST and len(frame) == 20:
+            optional_query.load(frame)
+        changed = []
+        if topics.decode_and_update_topic(frame, changed):
+            if len(frame) not in started:
+                # a value equal to the default does not change, the first frame of a chunk reports everything
+                # it decoded, so merge() sees the value at the start of every chunk
+                started.add(len(frame))
+                changed += [topic for topic in frame_topics(len(frame)) if topic not in changed]
+            for topic in changed:
+                rows.setdefault(topic.name, []).append((timestamp, topic.value))
+    return rows
+
+
+def decode_archive_window(path: str, window: (float, float)) -> {str: [(float, any)]}:
+    (since, until) = window
+    reader = ArchiveReader(path)
+    return decode_frames([(timestamp, bytes(frame)) for (timestamp, frame) in reader.read(since, until)
+                          if timestamp < until])
+
+
+def merge(results: [{str: [(float, any)]}]) -> {str: [(float, any)]}:
+    # results are in time order, every chunk starts with all values as changed, so repeats at chunk borders go
+    merged = {}
+    for result in results:
+        for name, rows in result.items():
+            series = merged.setdefault(name, [])
+            for row in rows:
+                if len(series) == 0 or series[-1][1] != row[1]:
+                    series.append(row)
+    return merged
+
+
+def write_csv(output: str, series: {str: [(float, any)]}):
+    for name, rows in series.items():
+        with open(os.path.join(output, name.replace("/", "_") + ".csv"), "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["time", "value"])
+            writer.writerows(rows)
+
+
+def write_numpy(output: str, series: {str: [(float, any)]}):
+    import numpy
+
+    for name, rows in series.items():
+        if any(isinstance(value, str) for (_, value) in rows):
+            logging.warning(F"decoder: {name} is not numeric, skipped")
+            continue
+        values = numpy.array([(t, numpy.nan if v is None else v) for (t, v) in rows], dtype=numpy.float64)
+        numpy.save(os.path.join(output, name.replace("/", "_") + ".npy"), values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode recorded heat pump frames into per topic series")
+    parser.add_argument("capture", help="frame archive or text capture (<unix time> <hex bytes> per line)")
+    parser.add_argument("--output", default=".", help="directory for the per topic files")
+    parser.add_argument("--format", choices=["csv", "npy"], default="csv")
+    parser.add_argument("--chunk", type=int, default=default_chunk_seconds, help="seconds of frames per job")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    os.makedirs(args.output, exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        if is_archive(args.capture):
+            blocks = ArchiveReader(args.capture).blocks
+            if len(blocks) == 0:
+                return
+            windows = chunk_windows(min(b.first for b in blocks), max(b.last for b in blocks), args.chunk)
+            results = executor.map(decode_archive_window, [args.capture] * len(windows), windows)
+        else:
+            chunks = {}
+            for frame in read_capture(args.capture):
+                chunks.setdefault(frame[0] // args.chunk, []).append(frame)
+            windows = sorted(chunks)
+            results = executor.map(decode_frames, [chunks[window] for window in windows])
+
+        series = merge(results)
+
+    logging.info(F"decoder: {len(windows)} chunks, {sum(len(rows) for rows in series.values())} values "
+                 F"of {len(series)} topics")
+    (write_numpy if args.format == "npy" else write_csv)(args.output, series)
+
+
+if __name__ == "__main__":
+    main()
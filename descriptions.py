@@ -94,3 +94,5 @@ knownModels = [  # stores the bytes  # 129 to  # 138 of known models in the same
     [0xC2, 0xD3, 0x0C, 0x34, 0x65, 0xB2, 0xD3, 0x0B, 0x95, 0x65],  # 27
     [0xC2, 0xD3, 0x0C, 0x33, 0x65, 0xB2, 0xD3, 0x0B, 0x94, 0x65],  # 28
 ]
+
+knownModelIndex = {bytes(model): idx for idx, model in reversed(list(enumerate(knownModels)))}
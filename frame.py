@@ -0,0 +1,129 @@
+import logging
+
+from topics import checksum
+
+POLL_REQUEST = "poll"
+COMMAND_REQUEST = "command"
+OPTIONAL_REQUEST = "optional request"
+MAIN_RESPONSE = "main"
+OPTIONAL_RESPONSE = "optional"
+
+# (header, length byte) -> kind, the length byte counts the bytes after itself without the checksum
+frame_kinds = {
+    (0x71, 0x6c): POLL_REQUEST,
+    (0xf1, 0x6c): COMMAND_REQUEST,
+    (0xf1, 0x11): OPTIONAL_REQUEST,
+    (0x71, 0xc8): MAIN_RESPONSE,
+    (0x71, 0x11): OPTIONAL_RESPONSE,
+}
+
+
+# state of the optional pcb as sent to the heat pump, before any command changed it
+optional_pcb_template = [0xF1, 0x11, 0x01, 0x50, 0x00, 0x00, 0x40, 0xFF, 0xFF, 0xE5,
+                         0xFF, 0xFF, 0x00, 0xFF, 0xEB, 0xFF, 0xFF, 0x00, 0x00]
+
+
+def frame_kind(data: []) -> str:
+    return frame_kinds.get((data[0], data[1])) if len(data) >= 2 else None
+
+
+def is_response(kind: str) -> bool:
+    return kind in (MAIN_RESPONSE, OPTIONAL_RESPONSE)
+
+
+class Frame:
+    # preallocated frame buffer that is reused for every send or receive, data is a view of the used part
+    def __init__(self, capacity: int, template: [] = None):
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        self.length = 0
+        self.data = self.view[:0]
+        if template is not None:
+            self.reset(template)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, idx):
+        return self.data[idx]
+
+    def __setitem__(self, idx, value):
+        self.data[idx] = value
+
+    def __str__(self):
+        return self.data.hex(" ")
+
+    def resize(self, length: int):
+        if length != self.length:
+            self.length = length
+            self.data = self.view[:length]
+
+    def load(self, data: []):
+        self.resize(len(data))
+        self.buffer[:self.length] = data
+
+    def reset(self, template: []):
+        # template without checksum, the last byte is reserved for it
+        self.resize(len(template) + 1)
+        self.buffer[:self.length - 1] = bytes(template)
+        self.seal()
+
+    def seal(self):
+        self.buffer[self.length - 1] = checksum(self.view[:self.length - 1])
+
+    @property
+    def free(self) -> memoryview:
+        return self.view[self.length:]
+
+
+class FrameReader:
+    def __init__(self):
+        self.buffer = bytearray()
+        self.skipped = 0
+
+    def feed(self, data: bytes):
+        # yields views into the stream buffer, they are only valid until the next frame is requested
+        self.buffer += data
+
+        while len(self.buffer) >= 2:
+            kind = frame_kind(self.buffer)
+            if kind is None:
+                self.skip()
+                continue
+
+            length = self.buffer[1] + 3
+            if len(self.buffer) < length:
+                break
+
+            with memoryview(self.buffer) as view, view[:length] as frame:
+                valid = checksum(frame[:-1]) == frame[-1]
+                if valid:
+                    if self.skipped > 0:
+                        logging.info(F"frame: skipped {self.skipped} bytes to resynchronize")
+                        self.skipped = 0
+                    yield kind, frame
+
+            if valid:
+                del self.buffer[:length]
+            else:
+                self.skip()
+
+    def skip(self):
+        # drop everything up to the next byte that could start a frame
+        for idx in range(1, len(self.buffer)):
+            if self.buffer[idx] in (0x71, 0xf1):
+                break
+        else:
+            idx = len(self.buffer)
+
+        self.skipped += idx
+        del self.buffer[:idx]
+
+
+def merge_optional_response(query: Frame, response: []) -> memoryview:
+    # optional pcb response to heatpump should contain the data from heatpump on byte 4 and 5, the optional
+    # topics are decoded from the query with those two bytes merged in
+    query[4] = response[4]
+    query[5] = response[5]
+    query.seal()
+    return query.data
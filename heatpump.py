@@ -1,145 +1,340 @@
 import traceback
-from datetime import datetime, timedelta
 
 from topics import *
+from commands import *
+from polling import AdaptivePollInterval
+from frame import *
+from metrics import Stopwatch, frames_received, poll_latency, decode_time, dispatch_time, \
+    command_queue_depth, command_queue_age, command_stage_time
+from clock import NEVER, default_clock
 from queue import Queue
+from time import monotonic
 import serial
 import logging
 
 minimum_poll_interval = 2
+default_command_timeout = 10
 
 
 class Heatpump:
     def __init__(self, device: str, poll_interval: int, optional_pcb_poll_interval: int,
-                 on_topic_received: any, on_topic_data: any):
+                 on_topic_received: any, on_topic_data: any,
+                 on_command_result: any = None, command_timeout: int = default_command_timeout,
+                 adaptive_poll_interval: (int, int) = None, listen_only: bool = False,
+                 on_command_trace: any = None, port: any = None, clock: any = default_clock):
 
-        self.pollQuery = [0x71, 0x6c, 0x01, 0x10] + [0x00] * 106
-        self.sendQuery = [0xf1, 0x6c, 0x01, 0x10] + [0x00] * 106
-        self.optionalPCBQuery = [0xF1, 0x11, 0x01, 0x50, 0x00, 0x00, 0x40, 0xFF, 0xFF, 0xE5,
-                                 0xFF, 0xFF, 0x00, 0xFF, 0xEB, 0xFF, 0xFF, 0x00, 0x00]
+        self.pollQuery = Frame(111, [0x71, 0x6c, 0x01, 0x10] + [0x00] * 106)
+        self.sendTemplate = bytes([0xf1, 0x6c, 0x01, 0x10] + [0x00] * 106)
+        self.sendQuery = Frame(111, self.sendTemplate)
+        self.optionalPCBQuery = Frame(20, optional_pcb_template)
+        # a bit more than the largest frame, so that overlong garbage is still recognized as such
+        self.receiveFrame = Frame(256)
+        self.chunk = memoryview(bytearray(256))
 
         self.device = device
+        self.clock = clock
+        # read once per loop, everything scheduled within one iteration uses the same time
+        self.now = clock.now()
         self.onTopicReceived = on_topic_received
         self.onTopicData = on_topic_data
+        self.onCommandResult = on_command_result
+        self.onCommandTrace = on_command_trace
         self.commandQueue = Queue()
+        self.commandTimeout = max(command_timeout, 2 * minimum_poll_interval)
+        self.pendingCommands = []
+        self.listeners = []
+        self.sinks = []
+        self.listenOnly = listen_only
+        self.frameReader = FrameReader() if listen_only else None
+        self.sniffedOptionalQuery = False
+        # time of the last write per expected response kind, for the poll latency
+        self.awaitingResponse = {}
+
+        if self.listenOnly:
+            poll_interval = 0
+            optional_pcb_poll_interval = 0
+
         self.pollInterval = None if poll_interval <= 0 else minimum_poll_interval \
             if poll_interval < minimum_poll_interval else poll_interval
 
+        self.adaptivePoll = None if self.pollInterval is None or adaptive_poll_interval is None else \
+            AdaptivePollInterval(max(adaptive_poll_interval[0], minimum_poll_interval),
+                                 max(adaptive_poll_interval[1], minimum_poll_interval))
+        if self.adaptivePoll:
+            self.pollInterval = self.adaptivePoll.interval
+
         self.optionalPollInterval = None if optional_pcb_poll_interval <= 0 else minimum_poll_interval \
             if optional_pcb_poll_interval < minimum_poll_interval else optional_pcb_poll_interval
 
-        self.serial = serial.Serial(self.device,
-                                    baudrate=9600,
-                                    parity=serial.PARITY_EVEN,
-                                    stopbits=serial.STOPBITS_ONE,
-                                    timeout=0.2)
+        # an already opened serial port (or anything that behaves like one) can be handed in instead of the device
+        self.serial = port if port is not None else serial.Serial(self.device,
+                                                                  baudrate=9600,
+                                                                  parity=serial.PARITY_EVEN,
+                                                                  stopbits=serial.STOPBITS_ONE,
+                                                                  timeout=0.2)
 
-        if self.pollInterval:
+        if self.listenOnly:
+            logging.info(F"heatpump: connected to {self.device} with 9600-8-E-1, listen only")
+            self.nextPoll = NEVER
+        elif self.adaptivePoll:
+            logging.info(F"heatpump: connected to {self.device} with 9600-8-E-1, adaptive poll interval "
+                         F"{self.adaptivePoll.minimum}s to {self.adaptivePoll.maximum}s")
+            self.nextPoll = self.now + 2
+        elif self.pollInterval:
             logging.info(F"heatpump: connected to {self.device} with 9600-8-E-1, poll interval {self.pollInterval}s")
-            self.nextPoll = datetime.now() + timedelta(seconds=2)
+            self.nextPoll = self.now + 2
         else:
             logging.info(F"heatpump: connected to {self.device} with 9600-8-E-1, no polling")
-            self.nextPoll = datetime.max
+            self.nextPoll = NEVER
 
         if self.optionalPollInterval:
             logging.info(F"heatpump: simulating optional pcb with poll interval {self.optionalPollInterval}s")
-            self.nextOptionalPoll = datetime.now() + timedelta(seconds=0)
+            self.nextOptionalPoll = self.now
         else:
-            self.nextOptionalPoll = datetime.max
+            self.nextOptionalPoll = NEVER
 
-        self.nextAllowedSend = datetime.now() + timedelta(seconds=minimum_poll_interval)
+        self.nextAllowedSend = self.now + minimum_poll_interval
+        self.lastPoll = None
 
     def on_receive(self, buffer: []):
         if len(buffer) == 20:
-            # optional pcb response to heatpump should contain the data from heatpump on byte 4 and 5
-            self.optionalPCBQuery[4] = buffer[4]
-            self.optionalPCBQuery[5] = buffer[5]
-            buffer = self.optionalPCBQuery + [checksum(self.optionalPCBQuery)]
+            buffer = merge_optional_response(self.optionalPCBQuery, buffer)
+
+        changed = []
+        with Stopwatch(decode_time):
+            valid = decode_and_update_topic(buffer, changed)
 
-        if decode_and_update_topic(buffer):
+        if valid:
+            kind = OPTIONAL_RESPONSE if len(buffer) == 20 else MAIN_RESPONSE
+            frames_received.inc(kind)
+            written = self.awaitingResponse.pop(kind, None)
+            if written is not None:
+                poll_latency.observe(self.now - written, kind)
+
+            for command in self.pendingCommands:
+                if command.topic.optional == (kind == OPTIONAL_RESPONSE) and RESPONDED not in command.times:
+                    command.mark(RESPONDED, self.now)
+                    self.trace_command(command, RESPONDED)
+
+            dispatch = monotonic()
             if self.onTopicData is not None:
-                self.onTopicData("optional" if len(buffer) == 20 else "main", buffer)
+                self.onTopicData(kind, bytes(buffer))
+
+            for listener in self.listeners:
+                try:
+                    listener(changed)
+                except Exception as err:
+                    logging.error(F"Unknown error in topic listener: {err}")
+
+            self.confirm_commands(len(buffer) == 20)
+
+            if self.adaptivePoll and len(buffer) == 203:
+                self.adapt_poll_interval(buffer)
 
             for topic in topics:
                 if self.onTopicReceived is not None:
                     if self.onTopicReceived(topic):
                         topic.delegated = True
 
+            for sink in self.sinks:
+                sink.dispatch(topics)
+
+            dispatch_time.observe(monotonic() - dispatch)
+
+    def add_listener(self, listener: any):
+        # listeners are called with the topics that changed with every valid frame
+        self.listeners.append(listener)
+
+    def add_sink(self, sink: any):
+        # sinks track what they have delivered themselves, see sinks.Sink
+        sink.attach(self)
+        self.sinks.append(sink)
+
+    def on_sniffed(self, kind: str, frame: bytearray):
+        if kind == OPTIONAL_REQUEST:
+            # the optional pcb on the bus tells the heat pump its state, that's what the optional topics decode from
+            self.optionalPCBQuery.load(frame)
+            self.sniffedOptionalQuery = True
+        elif kind == MAIN_RESPONSE or (kind == OPTIONAL_RESPONSE and self.sniffedOptionalQuery):
+            self.on_receive(frame)
+
     def shutdown(self):
         logging.info("heatpump: disconnecting")
         self.serial.close()
 
     def command(self, name: str, param: any):
+        received = self.clock.now()
+        if self.listenOnly:
+            raise ValueError(F"Command {name} cannot be sent, listening only.")
         topic = find_topic(name)
         if topic is None or not topic.writable:
             raise ValueError(F"Command {name} does not exist.")
         if not topic.accepts(param):
             raise ValueError(F"Command {name} does not accept value '{param}'.")
-        self.commandQueue.put((topic, topic.parse(param)))
+        command = Command(topic, topic.parse(param), received)
+        self.trace_command(command, RECEIVED)
+        command.mark(ENQUEUED, received)
+        self.commandQueue.put(command)
+        command_queue_depth.set(self.commandQueue.qsize())
+        self.trace_command(command, ENQUEUED)
+        return command
+
+    def confirm_commands(self, optional: bool):
+        for command in self.pendingCommands.copy():
+            if command.topic.optional == optional and command.confirm():
+                self.report_command(command)
+
+    def expire_commands(self):
+        for command in self.pendingCommands.copy():
+            if command.deadline < self.now:
+                command.result = TIMEOUT
+                self.report_command(command)
+
+    def report_command(self, command: Command):
+        self.pendingCommands.remove(command)
+        command.mark(COMPLETED, self.now)
+        for stage, duration in command.spans().items():
+            command_stage_time.observe(duration, stage)
+        self.trace_command(command, COMPLETED)
+        logging.info(F"heatpump: command {command}")
+        if self.onCommandResult is not None:
+            try:
+                self.onCommandResult(command)
+            except Exception as err:
+                logging.error(F"Unknown error while reporting command result: {err}")
+        for sink in self.sinks:
+            try:
+                sink.on_command_result(command)
+            except Exception as err:
+                logging.error(F"Unknown error while reporting command result to {sink.name}: {err}")
+
+    def trace_command(self, command: Command, stage: str):
+        if self.onCommandTrace is not None:
+            try:
+                self.onCommandTrace(command.trace(stage))
+            except Exception as err:
+                logging.error(F"Unknown error while tracing command: {err}")
+
+    def adapt_poll_interval(self, buffer: []):
+        self.pollInterval = self.adaptivePoll.update(buffer)
+        if self.lastPoll is not None:
+            next_poll = self.lastPoll + self.pollInterval
+            # keep a priority poll that is still owed to a written command
+            if any(not command.topic.optional and not command.polled for command in self.pendingCommands):
+                next_poll = min(self.nextPoll, next_poll)
+            self.nextPoll = next_poll
+
+    def request_priority_poll(self, optional: bool):
+        if optional:
+            self.nextOptionalPoll = min(self.nextOptionalPoll, self.nextAllowedSend)
+        else:
+            self.nextPoll = min(self.nextPoll, self.nextAllowedSend)
+
+    def mark_polled(self, optional: bool):
+        for command in self.pendingCommands:
+            if command.topic.optional == optional:
+                command.polled = True
 
     # def optional_command(self, name: str, param: int):
     #    if self.optionalCommand.set(name, param):
-    #        self.nextOptionalPoll = datetime.now() + timedelta(seconds=minimum_poll_interval)
+    #        self.nextOptionalPoll = self.now + minimum_poll_interval
     #        return True
     #    else:
     #        return False
 
+    def listen(self) -> bool:
+        if self.serial.in_waiting > 0:
+            received = self.serial.readinto(self.chunk[:min(self.serial.in_waiting, len(self.chunk))])
+            for (kind, frame) in self.frameReader.feed(self.chunk[:received]):
+                self.on_sniffed(kind, frame)
+
+        return True
+
     def loop(self) -> []:
-        buffer = []
+        self.now = self.clock.now()
+        if self.listenOnly:
+            return self.listen()
+
+        buffer = self.receiveFrame
 
         if self.serial.in_waiting > 0:
+            buffer.resize(0)
 
-            while True:
-                single_or_no_byte = self.serial.read(1)
-                if len(single_or_no_byte) > 0:
-                    buffer += single_or_no_byte
+            while len(buffer.free) > 0:
+                received = self.serial.readinto(buffer.free)
+                if received > 0:
+                    buffer.resize(len(buffer) + received)
                 else:
                     break
+            else:
+                self.serial.reset_input_buffer()
 
             if len(buffer) > 0:
                 # try:
-                self.on_receive(buffer)
+                self.on_receive(buffer.data)
                 # except Exception as err:
-                #    self.nextPoll = datetime.now() + timedelta(seconds=minimum_poll_interval)
+                #    self.nextPoll = self.now + minimum_poll_interval
                 #    logging.error(F"Unknown error while processing received data: {err}")
 
-        if self.nextAllowedSend < datetime.now():
+        if self.nextAllowedSend < self.now:
 
             if not self.commandQueue.empty():
                 try:
-                    (topic, param) = self.commandQueue.get()
+                    command = self.commandQueue.get()
+                    command_queue_depth.set(self.commandQueue.qsize())
+                    command_queue_age.observe(self.now - command.times[ENQUEUED])
+                    (topic, param) = (command.topic, command.value)
 
-                    query = self.optionalPCBQuery if topic.optional else self.sendQuery.copy()
-                    (idx, byte) = topic.encode(query, param)
+                    query = self.optionalPCBQuery
+                    if not topic.optional:
+                        query = self.sendQuery
+                        query.reset(self.sendTemplate)
+                    (idx, byte) = topic.encode(query.data, param)
                     query[idx] = byte
+                    query.seal()
 
                     if query is not None:
-                        self.nextAllowedSend = datetime.now() + timedelta(seconds=minimum_poll_interval)
+                        self.nextAllowedSend = self.now + minimum_poll_interval
                         logging.info(F"raw command: {topic} {param} -> {query}")
-                        self.serial.write(query + [checksum(query)])
+                        self.serial.write(query.data)
+                        self.awaitingResponse[OPTIONAL_RESPONSE if topic.optional else MAIN_RESPONSE] = self.now
+
+                        command.mark(WRITTEN, self.now)
+                        self.trace_command(command, WRITTEN)
+                        command.deadline = self.now + self.commandTimeout
+                        self.pendingCommands.append(command)
+                        self.request_priority_poll(topic.optional)
 
                     else:
                         logging.warning(F"Unknown command or invalid parameter '{topic}({param})'")
                 except Exception as err:
                     logging.error(F"Unknown error while sending command: {err}")
 
-            elif self.nextPoll < datetime.now():
+            elif self.nextPoll < self.now:
                 try:
                     logging.debug(F"Polling for new data {self.pollQuery}")
-                    self.nextPoll = datetime.now() + timedelta(seconds=self.pollInterval)
-                    self.nextAllowedSend = datetime.now() + timedelta(seconds=minimum_poll_interval)
-                    self.serial.write(self.pollQuery + [checksum(self.pollQuery)])
+                    self.lastPoll = self.now
+                    self.nextPoll = self.lastPoll + self.pollInterval if self.pollInterval else NEVER
+                    self.nextAllowedSend = self.now + minimum_poll_interval
+                    self.serial.write(self.pollQuery.data)
+                    self.awaitingResponse[MAIN_RESPONSE] = self.now
+                    self.mark_polled(False)
                 except Exception as err:
                     logging.error(F"Unknown error while polling: {err}")
 
-            elif self.nextOptionalPoll < datetime.now():
+            elif self.nextOptionalPoll < self.now:
                 try:
                     logging.debug(F"Polling for new optional data {self.optionalPCBQuery}")
-                    self.nextOptionalPoll = datetime.now() + timedelta(seconds=self.optionalPollInterval)
-                    self.nextAllowedSend = datetime.now() + timedelta(seconds=minimum_poll_interval)
-                    self.serial.write(self.optionalPCBQuery + [checksum(self.optionalPCBQuery)])
+                    self.nextOptionalPoll = self.now + self.optionalPollInterval if self.optionalPollInterval else NEVER
+                    self.nextAllowedSend = self.now + minimum_poll_interval
+                    self.serial.write(self.optionalPCBQuery.data)
+                    self.awaitingResponse[OPTIONAL_RESPONSE] = self.now
+                    self.mark_polled(True)
                 except Exception as err:
                     logging.error(F"Unknown error while polling optional data: {err}")
 
+        if len(self.pendingCommands) > 0:
+            self.expire_commands()
+
         return True
 
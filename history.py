@@ -0,0 +1,137 @@
+import json
+import logging
+from array import array
+from bisect import bisect_left, bisect_right
+from math import isnan, nan
+from time import monotonic, time
+
+from topics import Topic, find_topic
+
+default_history_size = 512
+
+
+class RingBuffer:
+    # fixed size (monotonic time, value) samples, oldest samples are overwritten
+    def __init__(self, size: int):
+        self.size = size
+        self.times = array("d", [0.0]) * size
+        self.values = array("d", [0.0]) * size
+        self.count = 0
+        self.head = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp: float, value: float):
+        self.times[self.head] = timestamp
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def index(self, n: int) -> int:
+        # physical index of the n-th oldest sample
+        return (self.head - self.count + n) % self.size
+
+    def time_at(self, n: int) -> float:
+        return self.times[self.index(n)]
+
+    def samples(self, start: int = 0, end: int = None) -> [(float, float)]:
+        end = self.count if end is None else end
+        return [(self.times[i], self.values[i]) for i in (self.index(n) for n in range(start, end))]
+
+    def latest(self, n: int) -> [(float, float)]:
+        return self.samples(max(0, self.count - n))
+
+    def bounds(self, since: float = None, until: float = None) -> (int, int):
+        # times are ascending in logical order, so the window can be found by bisecting over it
+        times = _LogicalTimes(self)
+        start = 0 if since is None else bisect_left(times, since)
+        end = self.count if until is None else bisect_right(times, until)
+        return start, end
+
+    def window(self, since: float = None, until: float = None) -> [(float, float)]:
+        return self.samples(*self.bounds(since, until))
+
+    def stats(self, since: float = None, until: float = None) -> dict:
+        return self.summarize(*self.bounds(since, until))
+
+    def summarize(self, start: int, end: int) -> dict:
+        values = [v for v in (self.values[self.index(n)] for n in range(start, end)) if not isnan(v)]
+        if len(values) == 0:
+            return {"count": 0}
+        return {"count": len(values), "min": min(values), "max": max(values), "avg": sum(values) / len(values)}
+
+
+class _LogicalTimes:
+    def __init__(self, ring: RingBuffer):
+        self.ring = ring
+
+    def __len__(self):
+        return self.ring.count
+
+    def __getitem__(self, n: int) -> float:
+        return self.ring.time_at(n)
+
+
+class History:
+    def __init__(self, size: int = default_history_size, clock: any = monotonic):
+        self.size = size
+        self.clock = clock
+        self.buffers = {}
+
+    def record(self, changed: [Topic]):
+        now = self.clock()
+        for topic in changed:
+            value = topic.value
+            if value is None:
+                value = nan
+            elif isinstance(value, str):
+                continue
+
+            ring = self.buffers.get(topic.id)
+            if ring is None:
+                ring = self.buffers[topic.id] = RingBuffer(self.size)
+            ring.append(now, value)
+
+    def buffer(self, name: str) -> RingBuffer:
+        topic = find_topic(name)
+        if topic is None:
+            raise ValueError(F"Topic {name} does not exist.")
+        ring = self.buffers.get(topic.id)
+        return RingBuffer(1) if ring is None else ring
+
+    def latest(self, name: str, n: int = 1) -> [(float, float)]:
+        return self.buffer(name).latest(n)
+
+    def window(self, name: str, seconds: float) -> [(float, float)]:
+        return self.buffer(name).window(self.clock() - seconds)
+
+    def stats(self, name: str, seconds: float = None) -> dict:
+        return self.buffer(name).stats(None if seconds is None else self.clock() - seconds)
+
+    def to_wall_time(self, timestamp: float) -> float:
+        return time() - (self.clock() - timestamp)
+
+    def handle_request(self, name: str, payload: str) -> str:
+        # request: {"seconds": 3600} for a time window or {"last": 10} for the latest samples, both with stats
+        request = json.loads(payload) if payload.strip() else {}
+        if not isinstance(request, dict):
+            raise ValueError(F"History request for {name} is not an object.")
+        ring = self.buffer(name)
+        try:
+            if "last" in request:
+                (start, end) = (max(0, len(ring) - max(0, int(request["last"]))), len(ring))
+            else:
+                seconds = request.get("seconds")
+                (start, end) = ring.bounds(None if seconds is None else self.clock() - float(seconds))
+        except TypeError as e:
+            raise ValueError(F"Invalid history request for {name}: {e}")
+
+        samples = ring.samples(start, end)
+        stats = ring.summarize(start, end)
+
+        o = {"samples": [[round(self.to_wall_time(t), 3), None if isnan(v) else v] for (t, v) in samples]}
+        o.update(stats)
+        logging.debug(F"history: {name} {request} -> {len(samples)} samples")
+        return json.dumps(o)
+
@@ -0,0 +1,105 @@
+import logging
+import sqlite3
+import threading
+from contextlib import closing
+from time import monotonic, time
+
+from topics import Topic
+
+default_flush_interval = 60
+default_flush_rows = 1000
+default_retention_days = 90
+compaction_interval = 3600
+
+
+class HistoryDatabase:
+    # buffers changed values in memory, a worker thread writes them in batches so frame handling never waits on disk
+    def __init__(self, path: str, flush_interval: int = default_flush_interval, flush_rows: int = default_flush_rows,
+                 retention_days: int = default_retention_days):
+        self.path = path
+        self.flushInterval = flush_interval
+        self.flushRows = flush_rows
+        self.retentionDays = retention_days
+        self.pending = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.running = True
+        self.topicIds = {}
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS topic (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS sample ("
+                                "topic INTEGER NOT NULL, time INTEGER NOT NULL, value, "
+                                "PRIMARY KEY (topic, time)) WITHOUT ROWID")
+        self.connection.commit()
+        for (topic_id, name) in self.connection.execute("SELECT id, name FROM topic"):
+            self.topicIds[name] = topic_id
+
+        self.worker = threading.Thread(target=self.run, name="historydb", daemon=True)
+        self.worker.start()
+
+    def record(self, changed: [Topic]):
+        now = int(time() * 1000)
+        with self.lock:
+            self.pending += [(topic.name, now, topic.value) for topic in changed]
+            full = len(self.pending) >= self.flushRows
+        if full:
+            self.wakeup.set()
+
+    def run(self):
+        next_compaction = monotonic() + compaction_interval
+        while self.running:
+            self.wakeup.wait(self.flushInterval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+                if self.retentionDays is not None and monotonic() > next_compaction:
+                    next_compaction = monotonic() + compaction_interval
+                    self.compact()
+            except sqlite3.Error as err:
+                logging.error(F"historydb: {err}")
+
+    def flush(self):
+        with self.lock:
+            (rows, self.pending) = (self.pending, [])
+        if len(rows) == 0:
+            return
+
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO sample VALUES (?, ?, ?)",
+                                        [(self.topic_id(name), timestamp, value) for (name, timestamp, value) in rows])
+        logging.debug(F"historydb: flushed {len(rows)} values")
+
+    def topic_id(self, name: str) -> int:
+        topic_id = self.topicIds.get(name)
+        if topic_id is None:
+            topic_id = self.connection.execute("INSERT INTO topic (name) VALUES (?)", (name,)).lastrowid
+            self.topicIds[name] = topic_id
+        return topic_id
+
+    def compact(self):
+        cutoff = int((time() - self.retentionDays * 86400) * 1000)
+        with self.connection:
+            deleted = self.connection.execute("DELETE FROM sample WHERE time < ?", (cutoff,)).rowcount
+        self.connection.execute("PRAGMA incremental_vacuum")
+        self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        logging.info(F"historydb: removed {deleted} values older than {self.retentionDays} days")
+
+    def query(self, name: str, since: float = None, until: float = None) -> [(float, any)]:
+        # own connection, WAL lets it read while the worker writes
+        with closing(sqlite3.connect(self.path)) as connection:
+            rows = connection.execute(
+                "SELECT sample.time, sample.value FROM sample JOIN topic ON topic.id = sample.topic "
+                "WHERE topic.name = ? AND sample.time >= ? AND sample.time <= ? ORDER BY sample.time",
+                (name, 0 if since is None else int(since * 1000), 2 ** 62 if until is None else int(until * 1000)))
+            return [(timestamp / 1000, value) for (timestamp, value) in rows]
+
+    def close(self):
+        self.running = False
+        self.wakeup.set()
+        self.worker.join()
+        self.flush()
+        self.connection.close()
@@ -0,0 +1,111 @@
+import json
+import logging
+import secrets
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from topics import Topic, topics, find_topic
+
+default_http_port = 8080
+default_long_poll = 30
+max_long_poll = 120
+
+
+def current_sequence() -> int:
+    return topics[0].state.sequence
+
+
+def topics_document(sequence: int, selected: [Topic]) -> bytes:
+    # the topics serialize themselves, the document is put together without parsing that again
+    members = ",".join(F"{json.dumps(topic.name)}:{topic.to_json()}" for topic in selected)
+    return F'{{"sequence":{sequence},"topics":{{{members}}}}}'.encode("utf-8")
+
+
+class HttpApi:
+    # JSON over HTTP: GET /state, GET /topic/<name> and GET /changes?since=<sequence>&timeout=<seconds>.
+    # /state is built once per change of the state, not once per request.
+    def __init__(self, port: int = default_http_port, host: str = "localhost"):
+        self.condition = threading.Condition()
+        self.cache = (None, None)
+        # sequences start over with every process, an ETag from before a restart must not match again
+        self.instance = secrets.token_hex(4)
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlsplit(self.path)
+                query = parse_qs(url.query)
+                try:
+                    if url.path == "/state":
+                        self.reply(*api.state())
+                    elif url.path.startswith("/topic/"):
+                        topic = find_topic(unquote(url.path[7:]))
+                        if topic is None:
+                            self.send_error(404)
+                            return
+                        self.reply(topic.to_json().encode("utf-8"), api.etag(topic.sequence))
+                    elif url.path == "/changes":
+                        since = int(query.get("since", ["0"])[0])
+                        timeout = min(float(query.get("timeout", [default_long_poll])[0]), max_long_poll)
+                        self.reply(api.changes(since, timeout))
+                    else:
+                        self.send_error(404)
+                except ValueError as err:
+                    self.send_error(400, str(err))
+
+            def reply(self, body: bytes, etag: str = None):
+                if etag is not None and etag in self.headers.get("If-None-Match", ""):
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                if etag is not None:
+                    self.send_header("ETag", etag)
+                    self.send_header("Cache-Control", "no-cache")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug(F"http: {self.address_string()} {format % args}")
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="http", daemon=True)
+        self.thread.start()
+        logging.info(F"http: serving on http://{host}:{self.server.server_address[1]}/state")
+
+    def record(self, changed: [Topic]):
+        # listener of the heat pump, wakes up the long polls
+        if len(changed) > 0:
+            with self.condition:
+                self.condition.notify_all()
+
+    def state(self) -> (bytes, str):
+        (sequence, document) = self.cache
+        while sequence != current_sequence():
+            # built outside of the serial loop, if a frame came in meanwhile it is built again
+            sequence = current_sequence()
+            document = topics_document(sequence, topics)
+            if sequence == current_sequence():
+                self.cache = (sequence, document)
+        return document, self.etag(sequence)
+
+    def etag(self, sequence: int) -> str:
+        return F'"{self.instance}-{sequence}"'
+
+    def changes(self, since: int, timeout: float) -> bytes:
+        with self.condition:
+            self.condition.wait_for(lambda: current_sequence() != since, timeout)
+        sequence = current_sequence()
+        if since > sequence:
+            # the client knows a sequence from before a restart, it gets everything
+            since = 0
+        return topics_document(sequence, [topic for topic in topics if topic.sequence > since])
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
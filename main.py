@@ -3,11 +3,23 @@
 from gi.repository import GLib
 from heatpump import Heatpump
 from topics import *
+from commands import Command
+from history import History, default_history_size
+from historydb import HistoryDatabase
+from archive import ArchiveWriter
+from rollup import Rollup
+from metrics import MetricsServer, default_metrics_port, publish_failures, registry as metrics_registry
+from profiler import Profiler
+import argparse
+import json
+import signal
+import tempfile
 import paho.mqtt.client as paho
 
 class Main(object):
 
-    def __init__(self):
+    def __init__(self, history_size: int = default_history_size, metrics_port: int = default_metrics_port,
+                 history_db: str = None, archive: str = None):
         self.client1 = paho.Client("control1")
         self.client1.connect("localhost", 1883)
 
@@ -15,6 +27,18 @@ class Main(object):
             self.client1.subscribe(
                 topic=F"Pysha/Set/{topic.name}")
 
+        self.client1.subscribe(topic="Pysha/Profile/Start")
+        self.profiler = Profiler(output_dir=tempfile.gettempdir(), on_report=self.on_profile)
+        # 16 bytes per sample and topic, 0 keeps no history
+        self.history = History(history_size) if history_size > 0 else None
+        if self.history is not None:
+            self.client1.subscribe(topic="Pysha/History/Get/#")
+        # values kept on disk beyond the in memory history, None keeps none
+        self.historyDatabase = HistoryDatabase(history_db) if history_db else None
+        # every decoded frame, for decoder.py
+        self.archive = ArchiveWriter(archive) if archive else None
+        self.rollup = Rollup(sinks=[self.profiler.wrap(self.on_rollup)])
+
         self.client1.loop_start()
 
         self.client1.on_message = self.on_message
@@ -23,10 +47,40 @@ class Main(object):
             device="/dev/ttyUSB0",
             poll_interval=10,
             optional_pcb_poll_interval=2,
-            on_topic_received=self.on_topic_received,
-            on_topic_data=None)
-
-        GLib.timeout_add(50, self.heatpump.loop)
+            on_topic_received=self.profiler.wrap(self.on_topic_received),
+            on_topic_data=self.archive.on_topic_data if self.archive is not None else None,
+            on_command_result=self.profiler.wrap(self.on_command_result),
+            on_command_trace=self.on_command_trace if logging.getLogger().isEnabledFor(logging.DEBUG) else None,
+            adaptive_poll_interval=(2, 60))
+
+        if self.history is not None:
+            self.heatpump.add_listener(self.history.record)
+        self.heatpump.add_listener(self.rollup.record)
+        if self.historyDatabase is not None:
+            self.heatpump.add_listener(self.historyDatabase.record)
+
+        GLib.timeout_add(50, self.profiler.wrap(self.heatpump.loop))
+        GLib.timeout_add(1000, self.profiler.wrap(self.rollup.tick))
+
+        # 0 serves no metrics, they are still published over MQTT
+        self.metricsServer = None
+        if metrics_port > 0:
+            try:
+                self.metricsServer = MetricsServer(metrics_port)
+            except OSError as e:
+                logging.warning(F"metrics: cannot serve on port {metrics_port}, {e}")
+        GLib.timeout_add(60000, self.profiler.wrap(self.publish_metrics))
+
+        # kill -USR1 <pid> profiles the next 30 seconds
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.profiler.start())
+
+    def close(self):
+        self.heatpump.shutdown()
+        if self.historyDatabase is not None:
+            self.historyDatabase.close()
+        if self.archive is not None:
+            self.archive.close()
+        self.client1.loop_stop()
 
     def on_topic_received(self, topic: Topic) -> bool:
         if not topic.delegated:
@@ -35,9 +89,37 @@ class Main(object):
                 payload=topic.to_json())
 
             logging.info(f"topic: {topic} {mid} {rc}")
+            if rc != 0:
+                publish_failures.inc("mqtt")
 
             return rc == 0
 
+    def on_command_result(self, command: Command):
+        self.client1.publish(
+            topic=F"Pysha/Result/{command.topic.name}",
+            payload=command.to_json())
+
+    def on_command_trace(self, event: dict):
+        logging.debug(F"trace: {json.dumps(event)}")
+
+    def on_rollup(self, interval: int, start: float, rows: dict):
+        self.client1.publish(
+            topic=F"Pysha/Rollup/{interval}",
+            payload=json.dumps({"start": start, "topics": rows}))
+
+    def publish_metrics(self) -> bool:
+        rc, mid = self.client1.publish(
+            topic="Pysha/Status/Metrics",
+            payload=metrics_registry.to_json())
+        if rc != 0:
+            publish_failures.inc("mqtt")
+        return True
+
+    def on_profile(self, path: str, summary: str):
+        self.client1.publish(
+            topic="Pysha/Profile/Result",
+            payload=json.dumps({"file": path, "summary": summary}))
+
     def on_message(self, client, userdata, message: paho.MQTTMessage):
         if not message.retain and message.payload is not None and message.topic.startswith("Pysha/Set/"):
             try:
@@ -47,6 +129,27 @@ class Main(object):
             except ValueError as e:
                 logging.warning(e)
 
+        elif self.history is not None and message.payload is not None and \
+                message.topic.startswith("Pysha/History/Get/"):
+            name = message.topic[18:]
+            try:
+                self.client1.publish(
+                    topic=F"Pysha/History/{name}",
+                    payload=self.history.handle_request(name, message.payload.decode('utf-8')))
+            except (TypeError, ValueError) as e:
+                logging.warning(e)
+
+        elif message.topic == "Pysha/Profile/Start":
+            # payload: {"seconds": 30, "mode": "cprofile" or "sample"}, both optional
+            try:
+                payload = message.payload.decode('utf-8') if message.payload else ""
+                request = json.loads(payload) if payload.strip() else {}
+                if not isinstance(request, dict):
+                    raise ValueError(F"Profile request {payload[:20]} is not an object.")
+                self.profiler.start(float(request.get("seconds", 30)), request.get("mode", "cprofile"))
+            except (TypeError, ValueError) as e:
+                logging.warning(e)
+
 
     def on_value_changed(self, path: str, value):
         #if path.lower().startswith("/topic/"):
@@ -60,13 +163,26 @@ class Main(object):
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Serve the heat pump over MQTT")
+    parser.add_argument("--history-size", type=int, default=default_history_size,
+                        help="samples kept in memory per topic, 0 for none")
+    parser.add_argument("--history-db", help="SQLite file to keep the history of every topic in")
+    parser.add_argument("--archive", help="file to append every decoded frame to, see decoder.py")
+    parser.add_argument("--metrics-port", type=int, default=default_metrics_port, help="0 to disable")
+    args = parser.parse_args()
+
     logging.basicConfig(level=logging.INFO)
 
-    Main()
+    service = Main(args.history_size, args.metrics_port, args.history_db, args.archive)
 
     logging.info('Connected')
     mainloop = GLib.MainLoop()
-    mainloop.run()
+    # what is still buffered gets written on a regular stop as well
+    GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGTERM, mainloop.quit)
+    try:
+        mainloop.run()
+    finally:
+        service.close()
 
 
 
@@ -0,0 +1,177 @@
+import json
+import logging
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic
+
+default_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+default_metrics_port = 9108
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: (str,) = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        # label values tuple -> value, the empty tuple for metrics without labels
+        self.values = {}
+
+    def label_text(self, values: tuple, extra: str = None) -> str:
+        pairs = [F'{label}="{value}"' for (label, value) in zip(self.labels, values)]
+        if extra is not None:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if len(pairs) > 0 else ""
+
+    def samples(self) -> [str]:
+        return [F"{self.name}{self.label_text(values)} {value}" for (values, value) in list(self.values.items())]
+
+    def to_json(self) -> any:
+        if len(self.labels) == 0:
+            return self.values.get((), 0)
+        return {"/".join(str(v) for v in values): value for (values, value) in list(self.values.items())}
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: (str,) = (), buckets: (float,) = default_buckets):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels):
+        # per label values: [count per bucket (+Inf last), sum]
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self) -> [str]:
+        lines = []
+        for (values, (counts, total)) in list(self.values.items()):
+            cumulative = 0
+            for (bound, count) in zip(list(self.buckets) + ["+Inf"], counts):
+                cumulative += count
+                le = F'le="{bound}"'
+                lines.append(F"{self.name}_bucket{self.label_text(values, le)} {cumulative}")
+            lines.append(F"{self.name}_sum{self.label_text(values)} {total}")
+            lines.append(F"{self.name}_count{self.label_text(values)} {cumulative}")
+        return lines
+
+    def to_json(self) -> any:
+        summaries = {"/".join(str(v) for v in values): {"count": sum(counts), "sum": round(total, 6)}
+                     for (values, (counts, total)) in list(self.values.items())}
+        return summaries.get("", {"count": 0, "sum": 0.0}) if len(self.labels) == 0 else summaries
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric: Metric) -> any:
+        if metric.name in self.metrics:
+            raise ValueError(F"Metric {metric.name} already exists.")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: (str,) = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: (str,) = ()) -> Gauge:
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: (str,) = (), buckets: (float,) = default_buckets) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        # prometheus text exposition format
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(F"# HELP {metric.name} {metric.help}")
+            lines.append(F"# TYPE {metric.name} {metric.kind}")
+            lines += metric.samples()
+        return "\n".join(lines) + "\n"
+
+    def to_json(self) -> str:
+        return json.dumps({name: metric.to_json() for (name, metric) in list(self.metrics.items())})
+
+
+registry = Registry()
+
+frames_received = registry.counter("pysha_frames_received_total", "Valid frames received", ("kind",))
+frames_invalid = registry.counter("pysha_frames_invalid_total", "Frames dropped as invalid", ("reason",))
+poll_latency = registry.histogram("pysha_poll_latency_seconds", "Time from writing a poll to its response",
+                                  ("kind",))
+decode_time = registry.histogram("pysha_decode_seconds", "Time to decode a frame into topics")
+dispatch_time = registry.histogram("pysha_dispatch_seconds", "Time to hand the topics of a frame to all consumers")
+command_queue_depth = registry.gauge("pysha_command_queue_depth", "Commands waiting to be written")
+command_queue_age = registry.histogram("pysha_command_queue_seconds", "Time a command waited before being written",
+                                       buckets=(0.1, 0.5, 1, 2, 5, 10, 30, 60, 120))
+command_stage_time = registry.histogram("pysha_command_stage_seconds", "Time a command spent in each stage",
+                                        ("stage",), buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 120))
+sink_queue_depth = registry.gauge("pysha_sink_queue_depth", "Updates waiting to be delivered by a sink", ("sink",))
+sink_dropped = registry.counter("pysha_sink_dropped_total", "Updates dropped because a sink queue was full", ("sink",))
+sink_lag = registry.histogram("pysha_sink_lag_seconds", "Time an update waited in a sink queue", ("sink",))
+publish_failures = registry.counter("pysha_publish_failures_total", "Values that could not be published",
+                                    ("sink",))
+
+
+class Stopwatch:
+    # with Stopwatch(decode_time): ... observes the elapsed seconds
+    def __init__(self, histogram: Histogram, *labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = monotonic()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(monotonic() - self.start, *self.labels)
+
+
+class MetricsServer:
+    # serves the registry on http://<host>:<port>/metrics from a daemon thread
+    def __init__(self, port: int = default_metrics_port, host: str = "localhost", metrics: Registry = registry):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug(F"metrics: {self.address_string()} {format % args}")
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True)
+        self.thread.start()
+        logging.info(F"metrics: serving on http://{host}:{self.server.server_address[1]}/metrics")
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,37 @@
+import logging
+
+from topics import find_topic
+
+default_key_topics = ["Status/Defrosting", "Status/Compressor/Freq", "Status/ThreeWayValve", "Control/HeatpumpState"]
+default_changed_bytes = 3
+
+
+class AdaptivePollInterval:
+    def __init__(self, minimum: int, maximum: int, changed_bytes: int = default_changed_bytes,
+                 key_topics: [str] = None):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.changedBytes = changed_bytes
+        self.keyTopics = [find_topic(name) for name in (default_key_topics if key_topics is None else key_topics)]
+        self.keyValues = None
+        self.previousFrame = bytearray()
+        self.interval = minimum
+
+    def update(self, frame: []) -> int:
+        key_values = [topic.value for topic in self.keyTopics if topic is not None]
+
+        if len(self.previousFrame) != len(frame):
+            busy = True
+        else:
+            # header and checksum are left out, the checksum changes with every other byte anyway
+            changed = sum(1 for i in range(4, len(frame) - 1) if frame[i] != self.previousFrame[i])
+            busy = changed >= self.changedBytes or key_values != self.keyValues
+
+        interval = self.minimum if busy else min(self.interval * 2, self.maximum)
+        if interval != self.interval:
+            logging.debug(F"heatpump: adaptive poll interval {self.interval}s -> {interval}s")
+
+        self.interval = interval
+        self.keyValues = key_values
+        self.previousFrame[:] = frame
+        return self.interval
@@ -0,0 +1,145 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+from time import monotonic, sleep
+
+CPROFILE = "cprofile"
+SAMPLE = "sample"
+
+default_profile_seconds = 30
+default_sample_interval = 0.005
+default_top = 20
+
+
+class Profiler:
+    # profiles only the calls made through wrap(), and only while a run started by start() lasts
+    def __init__(self, output_dir: str = ".", top: int = default_top, on_report: any = None,
+                 sample_interval: float = default_sample_interval):
+        self.outputDir = output_dir
+        self.top = top
+        self.onReport = on_report
+        self.sampleInterval = sample_interval
+        self.mode = None
+        self.deadline = None
+        self.depth = 0
+        self.thread = None
+        self.profile = None
+        self.samples = None
+        self.sampler = None
+
+    @property
+    def running(self) -> bool:
+        return self.deadline is not None
+
+    def start(self, seconds: float = default_profile_seconds, mode: str = CPROFILE) -> bool:
+        # may be called from a signal handler or another thread, the run begins with the next wrapped call
+        if self.running:
+            logging.warning("profiler: already running")
+            return False
+        if mode not in (CPROFILE, SAMPLE):
+            raise ValueError(F"Profiler mode {mode} does not exist.")
+
+        self.mode = mode
+        self.profile = cProfile.Profile() if mode == CPROFILE else None
+        self.samples = Counter() if mode == SAMPLE else None
+        self.deadline = monotonic() + seconds
+        logging.info(F"profiler: {mode} for {seconds}s")
+        return True
+
+    def wrap(self, fnc: any) -> any:
+        def wrapped(*args, **kwargs):
+            if not self.running:
+                return fnc(*args, **kwargs)
+
+            self.enter()
+            try:
+                return fnc(*args, **kwargs)
+            finally:
+                self.leave()
+        return wrapped
+
+    def enter(self):
+        self.depth += 1
+        if self.depth > 1:
+            return
+        if self.profile is not None:
+            self.profile.enable()
+        elif self.sampler is None:
+            self.thread = threading.get_ident()
+            self.sampler = threading.Thread(target=self.sample, name="profiler", daemon=True)
+            self.sampler.start()
+
+    def leave(self):
+        self.depth -= 1
+        if self.depth > 0:
+            return
+        if self.profile is not None:
+            self.profile.disable()
+        if monotonic() >= self.deadline:
+            self.finish()
+
+    def sample(self):
+        # collapsed stacks of the profiled thread, counted only while it is inside a wrapped call
+        while self.running and self.samples is not None:
+            if self.depth > 0:
+                frame = sys._current_frames().get(self.thread)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(F"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if len(stack) > 0:
+                    self.samples[";".join(reversed(stack))] += 1
+            sleep(self.sampleInterval)
+
+    def finish(self):
+        name = os.path.join(self.outputDir, F"pysha-{datetime.now().strftime('%Y%m%d-%H%M%S')}")
+        (mode, profile, samples) = (self.mode, self.profile, self.samples)
+        self.deadline = None
+        if self.sampler is not None:
+            self.sampler.join()
+            self.sampler = None
+
+        try:
+            if mode == CPROFILE:
+                path = name + ".pstats"
+                profile.dump_stats(path)
+                summary = self.summarize_profile(profile)
+            else:
+                path = name + ".folded"
+                with open(path, "w") as file:
+                    file.writelines(F"{stack} {count}\n" for stack, count in samples.items())
+                summary = self.summarize_samples(samples)
+        except OSError as err:
+            logging.error(F"profiler: {err}")
+            return
+
+        logging.info(F"profiler: written to {path}\n{summary}")
+        if self.onReport is not None:
+            try:
+                self.onReport(path, summary)
+            except Exception as err:
+                logging.error(F"Unknown error while reporting profile: {err}")
+
+    def summarize_profile(self, profile: cProfile.Profile) -> str:
+        stream = io.StringIO()
+        stats = pstats.Stats(profile, stream=stream)
+        stats.strip_dirs().sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+        return stream.getvalue()
+
+    def summarize_samples(self, samples: Counter) -> str:
+        # functions by the share of samples they were on top of the stack
+        total = sum(samples.values())
+        if total == 0:
+            return "no samples"
+        leaves = Counter()
+        for stack, count in samples.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return "\n".join(F"{count * 100 / total:5.1f}% {count:6} {function}"
+                         for function, count in leaves.most_common(self.top))
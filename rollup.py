@@ -0,0 +1,140 @@
+import json
+import logging
+import sqlite3
+from time import time
+
+from topics import Topic, topics
+
+default_intervals = (60, 900, 3600)
+
+
+class Aggregate:
+    __slots__ = ("min", "max", "sum", "count", "last", "since", "weighted", "covered")
+
+    def __init__(self, value: float, timestamp: float, carried: bool):
+        # a carried aggregate starts with the value of the previous bucket, without counting it as a sample
+        self.min = value
+        self.max = value
+        self.sum = 0.0 if carried else value
+        self.count = 0 if carried else 1
+        self.last = value
+        self.since = timestamp
+        self.weighted = 0.0
+        self.covered = 0.0
+
+    def add(self, value: float, timestamp: float):
+        self.weigh(timestamp)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.sum += value
+        self.count += 1
+        self.last = value
+
+    def weigh(self, timestamp: float):
+        duration = max(0.0, timestamp - self.since)
+        self.weighted += self.last * duration
+        self.covered += duration
+        self.since = timestamp
+
+    def close(self, end: float) -> dict:
+        self.weigh(end)
+        return {"min": self.min, "max": self.max,
+                "mean": self.sum / self.count if self.count > 0 else self.last,
+                "last": self.last,
+                "twmean": self.weighted / self.covered if self.covered > 0 else self.last,
+                "count": self.count}
+
+
+class Bucket:
+    def __init__(self, interval: int, start: float):
+        self.interval = interval
+        self.start = start
+        self.end = start + interval
+        self.aggregates = {}
+
+    def add(self, topic: Topic, value: float, timestamp: float):
+        aggregate = self.aggregates.get(topic.id)
+        if aggregate is None:
+            self.aggregates[topic.id] = Aggregate(value, timestamp, False)
+        else:
+            aggregate.add(value, timestamp)
+
+    def close(self) -> dict:
+        return {topics[topic_id].name: aggregate.close(self.end) for topic_id, aggregate in self.aggregates.items()}
+
+
+class Rollup:
+    def __init__(self, sinks: [any], intervals: (int,) = default_intervals, clock: any = time):
+        self.sinks = sinks
+        self.intervals = intervals
+        self.clock = clock
+        self.current = {}
+        now = self.clock()
+        self.buckets = [Bucket(interval, now // interval * interval) for interval in intervals]
+
+    def record(self, changed: [Topic]):
+        now = self.clock()
+        self.advance(now)
+        for topic in changed:
+            value = topic.value
+            if value is None or isinstance(value, str):
+                continue
+
+            self.current[topic.id] = value
+            for bucket in self.buckets:
+                bucket.add(topic, value, now)
+
+    def tick(self) -> bool:
+        self.advance(self.clock())
+        return True
+
+    def advance(self, now: float):
+        for idx, bucket in enumerate(self.buckets):
+            if now < bucket.end:
+                continue
+
+            self.emit(bucket.interval, bucket.start, bucket.close())
+
+            # buckets start on wall clock boundaries, values are carried over into the new one
+            following = Bucket(bucket.interval, now // bucket.interval * bucket.interval)
+            for topic_id, value in self.current.items():
+                following.aggregates[topic_id] = Aggregate(value, following.start, True)
+            self.buckets[idx] = following
+
+    def emit(self, interval: int, start: float, rows: dict):
+        if len(rows) == 0:
+            return
+
+        for sink in self.sinks:
+            try:
+                sink(interval, start, rows)
+            except Exception as err:
+                logging.error(F"Unknown error while emitting rollup: {err}")
+
+
+class JsonLinesSink:
+    def __init__(self, path: str):
+        self.path = path
+
+    def __call__(self, interval: int, start: float, rows: dict):
+        with open(self.path, "a") as file:
+            file.write(json.dumps({"interval": interval, "start": start, "topics": rows}) + "\n")
+
+
+class SqliteSink:
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS rollup ("
+                                "interval INTEGER NOT NULL, start INTEGER NOT NULL, topic TEXT NOT NULL, "
+                                "min REAL, max REAL, mean REAL, last REAL, twmean REAL, count INTEGER, "
+                                "PRIMARY KEY (interval, start, topic)) WITHOUT ROWID")
+
+    def __call__(self, interval: int, start: float, rows: dict):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO rollup VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(interval, int(start), name, r["min"], r["max"], r["mean"], r["last"], r["twmean"], r["count"])
+                 for name, r in rows.items()])
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,149 @@
+import struct
+from math import isnan, nan
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from time import sleep, time
+
+from topics import Topic
+
+default_segment_name = "pysha"
+
+# magic, version, topic count, names size, seqlock, change sequence of the state, time of the last write
+segment_header = struct.Struct("<4sHHIQQd")
+segment_magic = b"PSHM"
+segment_version = 1
+
+# change sequence, since, number, kind, text
+topic_slot = struct.Struct("<QddB31s")
+NONE = 0
+INT = 1
+FLOAT = 2
+TEXT = 3
+
+# readers give up on a snapshot after this many torn reads
+max_retries = 1000
+
+
+def encode_slot(topic: Topic) -> bytes:
+    value = topic.value
+    since = topic.state.since[topic.id]
+    if value is None:
+        return topic_slot.pack(topic.sequence, since, nan, NONE, b"")
+    if isinstance(value, str):
+        return topic_slot.pack(topic.sequence, since, nan, TEXT, value.encode("utf-8")[:31])
+    return topic_slot.pack(topic.sequence, since, value, INT if isinstance(value, int) else FLOAT, b"")
+
+
+def decode_slot(slot: tuple) -> (any, int, float):
+    (sequence, since, number, kind, text) = slot
+    since = None if isnan(since) else since
+    if kind == INT:
+        return int(number), sequence, since
+    if kind == FLOAT:
+        return number, sequence, since
+    if kind == TEXT:
+        return text.rstrip(b"\0").decode("utf-8", "replace"), sequence, since
+    return None, sequence, since
+
+
+class SharedState:
+    # publishes the current value of every topic into a shared memory segment with a fixed layout:
+    # header, one slot per topic id, then the topic names separated by newlines.
+    # Writers bump the seqlock to odd before and to even after a write, readers retry until they saw
+    # the same even value before and after their read.
+    def __init__(self, topics: [Topic], name: str = default_segment_name):
+        self.topics = topics
+        names = "\n".join(topic.name for topic in topics).encode("utf-8")
+        self.slots = segment_header.size
+        size = self.slots + topic_slot.size * len(topics) + len(names)
+        try:
+            self.memory = SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            # left behind by a previous run that did not shut down
+            stale = SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self.memory = SharedMemory(name, create=True, size=size)
+
+        self.buffer = self.memory.buf
+        self.lock = 0
+        self.buffer[self.slots + topic_slot.size * len(topics):size] = names
+        segment_header.pack_into(self.buffer, 0, segment_magic, segment_version, len(topics), len(names), 0, 0, 0.0)
+        self.record(topics)
+
+    def record(self, changed: [Topic]):
+        if len(changed) == 0:
+            return
+        slots = [(topic.id, encode_slot(topic)) for topic in changed]
+
+        self.lock += 1
+        struct.pack_into("<Q", self.buffer, 12, self.lock)
+        for (topic_id, slot) in slots:
+            offset = self.slots + topic_id * topic_slot.size
+            self.buffer[offset:offset + topic_slot.size] = slot
+        struct.pack_into("<Qd", self.buffer, 20, changed[0].state.sequence, time())
+        self.lock += 1
+        struct.pack_into("<Q", self.buffer, 12, self.lock)
+
+    def close(self):
+        self.buffer = None
+        self.memory.close()
+        self.memory.unlink()
+
+
+class SharedStateReader:
+    # lock free, consistent reads of a segment written by SharedState in another process
+    def __init__(self, name: str = default_segment_name):
+        self.memory = SharedMemory(name)
+        # only the writer owns the segment, python would otherwise remove it when this process exits
+        resource_tracker.unregister(self.memory._name, "shared_memory")
+        self.buffer = self.memory.buf
+
+        (magic, version, count, names_size, _, _, _) = segment_header.unpack_from(self.buffer, 0)
+        if magic != segment_magic or version != segment_version:
+            raise ValueError(F"Shared memory segment {name} is not a pysha state segment.")
+        self.count = count
+        self.slots = segment_header.size
+        names = bytes(self.buffer[self.slots + topic_slot.size * count:self.slots + topic_slot.size * count +
+                                  names_size]).decode("utf-8").split("\n")
+        self.ids = {topic_name.lower(): topic_id for topic_id, topic_name in enumerate(names)}
+        self.names = names
+
+    def read(self, start: int, end: int) -> (bytes, int, float):
+        for _ in range(max_retries):
+            (before,) = struct.unpack_from("<Q", self.buffer, 12)
+            if not before & 1:
+                data = bytes(self.buffer[start:end])
+                (sequence, updated) = struct.unpack_from("<Qd", self.buffer, 20)
+                (after,) = struct.unpack_from("<Q", self.buffer, 12)
+                if before == after:
+                    return data, sequence, updated
+            # let the writer finish
+            sleep(0)
+        raise TimeoutError("Shared state kept changing while reading it.")
+
+    @property
+    def sequence(self) -> int:
+        return self.read(0, 0)[1]
+
+    def get(self, name: str) -> any:
+        return self.get_slot(name)[0]
+
+    def get_slot(self, name: str) -> (any, int, float):
+        # value, change sequence and since (unix time) of one topic
+        topic_id = self.ids.get(name.lower())
+        if topic_id is None:
+            raise KeyError(F"Topic {name} does not exist.")
+        offset = self.slots + topic_id * topic_slot.size
+        (data, _, _) = self.read(offset, offset + topic_slot.size)
+        return decode_slot(topic_slot.unpack(data))
+
+    def snapshot(self) -> (int, {str: any}):
+        # change sequence of the state and all values, taken in one consistent read
+        (data, sequence, _) = self.read(self.slots, self.slots + topic_slot.size * self.count)
+        return sequence, {self.names[topic_id]: decode_slot(slot)[0]
+                          for topic_id, slot in enumerate(topic_slot.iter_unpack(data))}
+
+    def close(self):
+        self.buffer = None
+        self.memory.close()
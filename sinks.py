@@ -0,0 +1,234 @@
+import logging
+import threading
+from array import array
+from collections import OrderedDict, deque
+
+from clock import default_clock
+from metrics import publish_failures, sink_queue_depth, sink_dropped, sink_lag
+from topics import Topic, topics
+
+DROP_OLDEST = "drop-oldest"
+COALESCE = "coalesce"
+
+default_queue_size = 1024
+default_drain_batch = 256
+
+
+class Sink:
+    # an output of the bridge, every sink remembers per topic up to which change it has delivered, so a
+    # consumer that fails or lags behind only affects itself
+    name = "sink"
+
+    def __init__(self):
+        self.delivered = array("Q", [0]) * len(topics)
+        self.heatpump = None
+
+    def attach(self, heatpump: any):
+        self.heatpump = heatpump
+
+    def undelivered(self, candidates: [Topic]) -> [Topic]:
+        return [topic for topic in candidates if topic.sequence > self.delivered[topic.id]]
+
+    def dispatch(self, candidates: [Topic]):
+        for topic in self.undelivered(candidates):
+            sequence = topic.sequence
+            try:
+                delivered = self.deliver(topic)
+            except Exception as err:
+                logging.error(F"Unknown error while delivering {topic.name} to {self.name}: {err}")
+                delivered = False
+
+            if delivered:
+                self.delivered[topic.id] = sequence
+            else:
+                publish_failures.inc(self.name)
+
+    def deliver(self, topic: Topic) -> bool:
+        raise NotImplementedError
+
+    def on_command_result(self, command: any):
+        pass
+
+    def command(self, name: str, value: any) -> bool:
+        try:
+            self.heatpump.command(name, value)
+            logging.info(F"{self.name}: setting {name} to '{str(value)[:20]}'")
+            return True
+        except ValueError as e:
+            logging.warning(e)
+            return False
+
+    def close(self):
+        pass
+
+
+class QueuedSink(Sink):
+    # decouples a sink from the serial loop: dispatch only queues, the sink delivers on its own thread, or in
+    # batches on another loop when a scheduler such as GLib.idle_add is given (D-Bus wants its main loop)
+    def __init__(self, sink: Sink, size: int = default_queue_size, policy: str = COALESCE, scheduler: any = None):
+        if policy not in (DROP_OLDEST, COALESCE):
+            raise ValueError(F"Overflow policy {policy} does not exist.")
+
+        super().__init__()
+        self.sink = sink
+        self.name = sink.name
+        self.size = size
+        self.policy = policy
+        self.scheduler = scheduler
+        self.scheduled = False
+        # coalescing keeps one entry per topic id, the latest change replaces the one still waiting
+        self.queue = OrderedDict() if policy == COALESCE else deque()
+        self.condition = threading.Condition()
+        self.running = True
+        self.worker = None
+        if scheduler is None:
+            self.worker = threading.Thread(target=self.run, name=F"sink-{self.name}", daemon=True)
+            self.worker.start()
+
+    def attach(self, heatpump: any):
+        super().attach(heatpump)
+        self.sink.attach(heatpump)
+
+    def dispatch(self, candidates: [Topic]):
+        now = default_clock.now()
+        with self.condition:
+            for topic in self.undelivered(candidates):
+                self.delivered[topic.id] = topic.sequence
+                self.put(topic, now)
+            sink_queue_depth.set(len(self.queue), self.name)
+            self.condition.notify()
+
+        if self.scheduler is not None and not self.scheduled and len(self.queue) > 0:
+            self.scheduled = True
+            self.scheduler(self.drain)
+
+    def put(self, topic: Topic, now: float):
+        if self.policy == COALESCE:
+            if topic.id in self.queue:
+                # keeps its place and the time it has been waiting since
+                return
+            if len(self.queue) >= self.size:
+                self.drop(self.queue.popitem(last=False)[1][0])
+            self.queue[topic.id] = (topic, now)
+        else:
+            if len(self.queue) >= self.size:
+                self.drop(self.queue.popleft()[0])
+            self.queue.append((topic, now))
+
+    def drop(self, topic: Topic):
+        # a dropped change is not delivered, it is queued again with the next frame
+        self.delivered[topic.id] = self.sink.delivered[topic.id]
+        sink_dropped.inc(self.name)
+
+    def take(self) -> (Topic, float):
+        if self.policy == COALESCE:
+            return self.queue.popitem(last=False)[1]
+        return self.queue.popleft()
+
+    def deliver_next(self) -> bool:
+        # everything waiting, up to a batch, goes to the sink in one dispatch, so the changes of one frame
+        # arrive together
+        with self.condition:
+            if len(self.queue) == 0:
+                return False
+            batch = [self.take() for _ in range(min(len(self.queue), default_drain_batch))]
+            sink_queue_depth.set(len(self.queue), self.name)
+
+        # the sink reads the value when it delivers, an older change still queued behind a newer one of the
+        # same topic finds it delivered already
+        now = default_clock.now()
+        for (_, enqueued) in batch:
+            sink_lag.observe(now - enqueued, self.name)
+        pending = list({topic.id: topic for (topic, _) in batch}.values())
+        self.sink.dispatch(pending)
+        with self.condition:
+            waiting = self.waiting()
+            for topic in pending:
+                if self.sink.delivered[topic.id] < topic.sequence and topic.id not in waiting:
+                    # not delivered, queue it again with the next frame
+                    self.delivered[topic.id] = self.sink.delivered[topic.id]
+        return True
+
+    def waiting(self) -> any:
+        return self.queue if self.policy == COALESCE else {topic.id for (topic, _) in self.queue}
+
+    def run(self):
+        while self.running:
+            with self.condition:
+                while self.running and len(self.queue) == 0:
+                    self.condition.wait()
+            while self.deliver_next():
+                pass
+
+    def drain(self) -> bool:
+        # one batch per idle callback, the main loop gets back control in between
+        if not self.deliver_next():
+            self.scheduled = False
+            return False
+        return True
+
+    def on_command_result(self, command: any):
+        self.sink.on_command_result(command)
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.worker is not None:
+            self.worker.join()
+        self.sink.close()
+
+
+class MqttSink(Sink):
+    name = "mqtt"
+
+    def __init__(self, host: str = "localhost", port: int = 1883, prefix: str = "Pysha", client_id: str = "pysha"):
+        import paho.mqtt.client as paho
+
+        super().__init__()
+        self.prefix = prefix
+        self.client = paho.Client(client_id)
+        self.client.on_message = self.on_message
+        self.client.connect(host, port)
+        self.client.loop_start()
+
+    def attach(self, heatpump: any):
+        super().attach(heatpump)
+        self.client.subscribe(topic=F"{self.prefix}/Set/#")
+
+    def deliver(self, topic: Topic) -> bool:
+        rc, mid = self.client.publish(topic=F"{self.prefix}/{topic.name}", payload=topic.to_json())
+        logging.debug(F"mqtt: {topic} {mid} {rc}")
+        return rc == 0
+
+    def on_command_result(self, command: any):
+        self.client.publish(topic=F"{self.prefix}/Result/{command.topic.name}", payload=command.to_json())
+
+    def on_message(self, client, userdata, message):
+        setter = F"{self.prefix}/Set/"
+        if not message.retain and message.payload is not None and message.topic.startswith(setter):
+            self.command(message.topic[len(setter):], message.payload.decode('utf-8'))
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+class DbusSink(Sink):
+    name = "dbus"
+
+    def __init__(self, servicename: str = "com.victronenergy.pysha.ttyO1", deviceinstance: int = 0,
+                 productname: str = "Aquarea Heatpump", connection: str = "RS485"):
+        from veservice import create_service
+
+        super().__init__()
+        self.service = create_service(servicename, deviceinstance, self.on_value_changed, productname, connection)
+
+    def deliver(self, topic: Topic) -> bool:
+        self.service[F"/Topic/{topic.name}"] = topic.value
+        return True
+
+    def on_value_changed(self, path: str, value) -> bool:
+        if path.lower().startswith("/topic/"):
+            return self.command(path[7:], value)
+        return False
@@ -0,0 +1,92 @@
+import unittest
+
+import topics
+from topics import NTC_MAPPING
+
+# the decoders as they were before the lookup tables, the tables have to give the same results
+
+
+def old_get_op_mode(value):
+    op_mode = int(value & 0b111111)
+    if op_mode == 18:
+        return "0"
+    elif op_mode == 19:
+        return "1"
+    elif op_mode == 25:
+        return "2"
+    elif op_mode == 33:
+        return "3"
+    elif op_mode == 34:
+        return "4"
+    elif op_mode == 35:
+        return "5"
+    elif op_mode == 41:
+        return "6"
+    elif op_mode == 26:
+        return "7"
+    elif op_mode == 42:
+        return "8"
+    else:
+        return "-1"
+
+
+def old_ntc_of_temp(temp: int) -> int:
+    for idx, val in enumerate(NTC_MAPPING):
+        if temp >= val:
+            return idx
+    return 255
+
+
+old_helpers = {
+    "BIT_1": lambda value: value >> 7,
+    "BITS_1_AND_2": lambda value: (value >> 6) - 1,
+    "BITS_3_AND_4": lambda value: ((value >> 4) & 0b11) - 1,
+    "BITS_5_AND_6": lambda value: ((value >> 2) & 0b11) - 1,
+    "BITS_7_AND_8": lambda value: (value & 0b11) - 1,
+    "BITS_3_TO_5": lambda value: ((value >> 3) & 0b111) - 1,
+    "LEFT_5_BITS": lambda value: (value >> 3) - 1,
+    "RIGHT_3_BITS": lambda value: (value & 0b111) - 1,
+    "INT_MINUS_1": lambda value: int(value) - 1,
+    "INT_MINUS_128": lambda value: int(value) - 128,
+    "INT_MINUS_1_DIV_5": lambda value: round((float(value) - 1) / 5, 1),
+    "INT_MINUS_1_TIMES_10": lambda value: (int(value) - 1) * 10,
+    "INT_MINUS_1_TIMES_50": lambda value: (int(value) - 1) * 50,
+    "ENERGY": lambda value: (int(value) - 1) * 200,
+}
+
+
+class TablesTest(unittest.TestCase):
+    def test_op_mode(self):
+        for value in range(256):
+            self.assertEqual(topics.OP_MODE[value], int(old_get_op_mode(value)), value)
+            self.assertEqual(topics.get_op_mode(value), int(old_get_op_mode(value)), value)
+
+    def test_op_mode_unknown(self):
+        self.assertEqual(topics.OP_MODE[0], -1)
+        self.assertEqual(topics.OP_MODE[0b11000000 | 18], 0)
+        self.assertEqual(topics.OP_MODE[63], -1)
+
+    def test_ntc_of_temp(self):
+        # every mapped temperature, beyond both ends and between whole degrees
+        for temp in range(NTC_MAPPING[-1] - 50, NTC_MAPPING[0] + 50):
+            self.assertEqual(topics.ntc_of_temp(temp), old_ntc_of_temp(temp), temp)
+            self.assertEqual(topics.ntc_of_temp(temp + 0.5), old_ntc_of_temp(temp + 0.5), temp + 0.5)
+
+    def test_ntc_of_temp_table(self):
+        for (idx, ntc) in enumerate(topics.NTC_OF_TEMP):
+            self.assertEqual(ntc, old_ntc_of_temp(NTC_MAPPING[-1] + idx), idx)
+
+    def test_byte_tables(self):
+        for (name, helper) in old_helpers.items():
+            table = getattr(topics, name)
+            self.assertEqual(len(table), 256, name)
+            for value in range(256):
+                self.assertEqual(table[value], helper(value), F"{name}[{value}]")
+
+    def test_every_table_is_tested(self):
+        tables = {name for name in dir(topics) if name.startswith(("BIT_", "BITS_", "INT_"))}
+        self.assertEqual(tables - set(old_helpers), set())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,13 @@
 import logging
 
 import descriptions
+import metrics
 from datetime import datetime
+from time import time
+from array import array
+from math import floor, isnan, nan
 import json
+import sys
 
 NTC_MAPPING: [int] = [120, 120, 120, 120, 120, 120, 120, 120, 120, 120, 120, 120, 117, 114, 111, 108,
                       106, 103, 101, 99, 97, 95, 93, 92, 90, 88, 87, 86, 84, 83, 82, 80,
@@ -21,30 +26,221 @@ NTC_MAPPING: [int] = [120, 120, 120, 120, 120, 120, 120, 120, 120, 120, 120, 120
                       -16, -17, -18, -18, -19, -20, -21, -21, -22, -23, -24, -25, -26, -27, -28, -29,
                       -30, -31, -32, -33, -35, -36, -38, -40, -41, -44, -46, -49, -53, -57, -64, -78]
 
+# first ntc byte at or below a temperature, indexed by the temperature minus the lowest mapped one
+NTC_OF_TEMP: (int,) = tuple(next(idx for idx, val in enumerate(NTC_MAPPING) if temp >= val)
+                            for temp in range(NTC_MAPPING[-1], NTC_MAPPING[0] + 1))
+
+OP_MODES = {18: 0, 19: 1, 25: 2, 33: 3, 34: 4, 35: 5, 41: 6, 26: 7, 42: 8}
+OP_MODE: (int,) = tuple(OP_MODES.get(value & 0b111111, -1) for value in range(256))
+OP_CODE_OF_MODE: (int,) = (18, 19, 24, 33, 34, 35, 40, 0, 0)
+
+
+def intern_enum(enum: []) -> []:
+    if enum is None:
+        return None
+    return interned_enums.setdefault(tuple(enum), enum)
+
+
+# the enum lists of descriptions.py are the canonical instances identical inline lists are folded into
+interned_enums = {tuple(v): v for v in vars(descriptions).values() if isinstance(v, list) and
+                  all(isinstance(s, str) for s in v)}
+
+
+class TopicInfo:
+    # immutable metadata of a topic, shared by all devices
+    __slots__ = ("name", "unit", "enum", "area", "decode_fnc", "encode_fnc", "default", "optional", "help",
+                 "source", "inputs")
+
+    def __init__(self, name: str, unit: str, enum: [], area: (float, float), decd: any, encd: any, dflt: any,
+                 optn: bool, help: str, stat: (int, int), inputs: (str,) = None):
+        self.name = sys.intern(name)
+        self.unit = None if unit is None else sys.intern(unit)
+        self.enum = intern_enum(enum)
+        self.area = area
+        self.decode_fnc = decd
+        self.encode_fnc = encd
+        self.default = dflt
+        self.optional = optn
+        self.help = None if help is None else sys.intern(help)
+        # static topics are only decoded when the bytes in this range changed
+        self.source = stat
+        # derived topics are computed from the values of these topics instead of being decoded from a frame
+        self.inputs = None if inputs is None else tuple(sys.intern(name) for name in inputs)
+
+
+class TopicState:
+    # mutable state of all topics of one device, stored column-wise and indexed by topic id
+    __slots__ = ("raw_values", "previous_values", "previous_durations", "since", "dirty", "sources",
+                 "sequences", "sequence")
+
+    def __init__(self, topics: []):
+        size = len(topics)
+        self.raw_values = [topic.info.default for topic in topics]
+        self.previous_values = [None] * size
+        self.previous_durations = array("d", [nan]) * size
+        self.since = array("d", [nan]) * size
+        self.dirty = bytearray(size)
+        self.sources = {}
+        # every change gets the next number of the state wide sequence, consumers remember what they have seen
+        self.sequences = array("Q", [0]) * size
+        self.sequence = 0
+
+    def bind(self, topics: []) -> []:
+        # views of the given topics on this state, used to run several devices side by side:
+        # decode_and_update_topic(data, changed, TopicRegistry(TopicState(topics).bind(topics)))
+        return [topic.with_state(self) for topic in topics]
+
+
+def register_topics(topics: []) -> TopicState:
+    for topic_id, topic in enumerate(topics):
+        topic.id = topic_id
+
+    state = TopicState(topics)
+    for topic in topics:
+        topic.state = state
+    return state
+
+
+class TopicRegistry:
+    def __init__(self, topics: []):
+        self.topics = topics
+        self.names = {topic.name.lower(): topic for topic in topics}
+        decoded = [topic for topic in topics if topic.info.inputs is None]
+        self.main = [topic for topic in decoded if not topic.optional and topic.info.source is None]
+        self.optional = [topic for topic in decoded if topic.optional and topic.info.source is None]
+        self.partitions = {203: self.main, 20: self.optional}
+        self.static = {203: {}, 20: {}}
+        for topic in decoded:
+            if topic.info.source is not None:
+                self.static[20 if topic.optional else 203].setdefault(topic.info.source, []).append(topic)
+
+        # input topic id -> derived topics to evaluate when it changes, derived topic id -> its input topics
+        self.dependents = {}
+        self.inputs = {}
+        for topic in topics:
+            if topic.info.inputs is not None:
+                self.inputs[topic.id] = [self.names[name.lower()] for name in topic.info.inputs]
+                for input_topic in self.inputs[topic.id]:
+                    self.dependents.setdefault(input_topic.id, []).append(topic)
+        # nested dicts over the lower case name levels, a topic is stored under the key None of its node
+        self.tree = {}
+        for topic in topics:
+            node = self.tree
+            for level in topic.name.lower().split("/"):
+                node = node.setdefault(level, {})
+            node[None] = topic
+
+    def find(self, name: str):
+        return self.names.get(name.lower())
+
+    @property
+    def state(self) -> TopicState:
+        # the state the topics are bound to, looked up as reset_topics binds the global topics to a new one
+        return self.topics[0].state
+
+    def partition(self, length: int) -> []:
+        return self.partitions.get(length, [])
+
+    def static_partition(self, length: int) -> dict:
+        return self.static.get(length, {})
+
+    def derive(self, changed: []) -> []:
+        # evaluates every derived topic depending on a changed topic once, derived topics may depend on each other
+        derived = []
+        pending = [topic for changed_topic in changed for topic in self.dependents.get(changed_topic.id, ())]
+        while len(pending) > 0:
+            topic = pending.pop(0)
+            if topic in pending:
+                continue
+            values = [input_topic.value for input_topic in self.inputs[topic.id]]
+            value = None if None in values else topic.decode_fnc(*values)
+            if topic.update(value):
+                derived.append(topic)
+                pending += self.dependents.get(topic.id, ())
+
+        return derived
+
+    def query(self, pattern: str) -> []:
+        # '*' matches exactly one level, a trailing '#' matches any number of levels
+        nodes = [self.tree]
+        for level in pattern.lower().split("/"):
+            if level == "#":
+                return [topic for node in nodes for topic in self.collect(node)]
+            elif level == "*":
+                nodes = [child for node in nodes for key, child in node.items() if key is not None]
+            else:
+                nodes = [node[level] for node in nodes if level in node]
+
+        return [node[None] for node in nodes if None in node]
+
+    def collect(self, node: dict) -> []:
+        for key, child in node.items():
+            if key is None:
+                yield child
+            else:
+                yield from self.collect(child)
+
 
 class Topic:
+    __slots__ = ("id", "info", "state")
+
     def __init__(self, name: str, unit: str = None, enum: [] = None, area: (float, float) = None,
                  decd: any = None, encd: any = None,
                  dflt: any = None, optn: bool = False,
-                 help: str = None):
-        self.raw_value = dflt
-        self.name = name
-        self.unit = unit
-        self.decode_fnc = decd
-        self.encode_fnc = encd
-        self.enum = enum
-        self.area = area
-        self.since = None
-        self.delegated: bool = True
-        self.optional = optn
-        self.help = help
-        self.previous_value = None
-        self.previous_duration = None
-        pass
+                 help: str = None, stat: (int, int) = None):
+        self.id = None
+        self.info = TopicInfo(name, unit, enum, area, decd, encd, dflt, optn, help, stat)
+        self.state = None
+
+    def with_state(self, state: TopicState):
+        topic = Topic.__new__(Topic)
+        topic.id = self.id
+        topic.info = self.info
+        topic.state = state
+        return topic
+
+    name = property(lambda self: self.info.name)
+    unit = property(lambda self: self.info.unit)
+    enum = property(lambda self: self.info.enum)
+    area = property(lambda self: self.info.area)
+    decode_fnc = property(lambda self: self.info.decode_fnc)
+    encode_fnc = property(lambda self: self.info.encode_fnc)
+    optional = property(lambda self: self.info.optional)
+    help = property(lambda self: self.info.help)
+
+    @property
+    def raw_value(self) -> any:
+        return self.state.raw_values[self.id]
+
+    @property
+    def previous_value(self) -> any:
+        return self.state.previous_values[self.id]
+
+    @property
+    def previous_duration(self) -> float:
+        duration = self.state.previous_durations[self.id]
+        return None if isnan(duration) else duration
+
+    @property
+    def since(self) -> datetime:
+        since = self.state.since[self.id]
+        return None if isnan(since) else datetime.fromtimestamp(since)
+
+    @property
+    def sequence(self) -> int:
+        return self.state.sequences[self.id]
+
+    @property
+    def delegated(self) -> bool:
+        return not self.state.dirty[self.id]
+
+    @delegated.setter
+    def delegated(self, delegated: bool) -> None:
+        self.state.dirty[self.id] = not delegated
 
     def decode(self, packet_data: bytearray):
         if len(packet_data) == (20 if self.optional else 203):
-            self.value = self.decode_fnc(packet_data)
+            self.update(self.decode_fnc(packet_data))
 
     def encode(self, current_packet_data: bytearray, value) -> (int, int):
         return self.encode_fnc(current_packet_data, value)
@@ -89,22 +285,32 @@ class Topic:
 
     @value.setter
     def value(self, value: any) -> None:
-        new_value: int = self.parse(value)
-        if new_value != self.raw_value:
-            now = datetime.now()
-            self.previous_value = self.raw_value
-            if self.since is not None:
-                self.previous_duration = (now - self.since).total_seconds()
-            self.raw_value = new_value
-            self.since = now
-            self.delegated = False
+        self.update(self.parse(value))
+
+    def update(self, value: any) -> bool:
+        # trusted path for values coming from the decoders, external input has to go through the value setter
+        state = self.state
+        if value == state.raw_values[self.id]:
+            return False
+
+        now = time()
+        state.previous_values[self.id] = state.raw_values[self.id]
+        if not isnan(state.since[self.id]):
+            state.previous_durations[self.id] = now - state.since[self.id]
+        state.raw_values[self.id] = value
+        state.since[self.id] = now
+        state.dirty[self.id] = True
+        state.sequence += 1
+        state.sequences[self.id] = state.sequence
+        return True
 
     @property
     def description(self) -> str:
         if self.raw_value is None:
             return None
         elif self.enum is not None:
-            return self.enum[self.raw_value]
+            # decoded values are not validated, a value outside of the enum is shown as is
+            return self.enum[self.raw_value] if 0 <= self.raw_value < len(self.enum) else str(self.raw_value)
         else:
             return str(self.raw_value) + ("" if self.unit is None else " " + self.unit)
 
@@ -135,48 +341,59 @@ class Topic:
 
         return json.dumps(o)
 
+class DerivedTopic(Topic):
+    __slots__ = ()
+
+    def __init__(self, name: str, inputs: [str], fnc: any, unit: str = None, area: (float, float) = None,
+                 help: str = None):
+        super().__init__(name=name, unit=unit, area=area, decd=fnc, help=help)
+        self.info.inputs = tuple(sys.intern(name) for name in inputs)
+
+
 topics_heatpump = [
     Topic(name="Model/ID",
           help="Heat pump model",
           area=(0, len(descriptions.Model) - 1),
-          decd=lambda d: get_model(d)),
+          decd=lambda d: get_model(d),
+          stat=(129, 139)),
     Topic(name="Model/Name",
           help="Heat pump model",
-          decd=lambda d: descriptions.Model[get_model(d)]),
+          decd=lambda d: descriptions.Model[get_model(d)],
+          stat=(129, 139)),
     Topic(name="Control/HeatpumpState",
           help="Heatpump state",
           enum=["Off", "On"],
-          decd=lambda d: bits_7_and_8(d[4]),
+          decd=lambda d: BITS_7_AND_8[d[4]],
           encd=lambda d, onoff: (4, 2 if onoff else 1)),
     Topic(name="Control/HolidayMode",
           help="Whether holiday mode is off, active or scheduled",
           enum=["Off", "Scheduled", "Active"],
-          decd=lambda d: bits_3_and_4(d[5]),
+          decd=lambda d: BITS_3_AND_4[d[5]],
           encd=lambda d, onoff: (5, 32 if onoff else 16)),
     Topic(name="Control/MainSchedule",
           help="Main thermostat schedule used or not used",
           enum=["Disabled", "Enabled"],
-          decd=lambda d: bits_1_and_2(d[5]),
+          decd=lambda d: BITS_1_AND_2[d[5]],
           encd=lambda d, onoff: (5, 128 if onoff else 64)),
     Topic(name="Control/OperatingMode",
           help="Operating mode of the heat pump, as settable on the remote control",
           enum=["Heat", "Cool", "Auto(heat)", "DHW", "Heat+DHW", "Cool+DHW",
                 "Auto(heat)+DHW", "Auto(cool)", "Auto(cool)+DHW"],
-          decd=lambda d: get_op_mode(d[6]),
-          encd=lambda d, mode: (6, [18, 19, 24, 33, 34, 35, 40][mode] if mode < 7 else 0)),
+          decd=lambda d: OP_MODE[d[6]],
+          encd=lambda d, mode: (6, OP_CODE_OF_MODE[mode])),
     Topic(name="Control/PowerfulMode",
           help="Powerful mode timeout",
           enum=["Off", "30min", "60min", "90min"],
-          decd=lambda d: right_3_bits(d[7]),
+          decd=lambda d: RIGHT_3_BITS[d[7]],
           encd=lambda d, mode: (7, min(3, max(0, mode)) + 73)),  # fixme: does +73 make sense?
     Topic(name="Control/QuietMode/Schedule",
           help="Quiet mode schedule used or not used",
           enum=["Disabled", "Enabled"],
-          decd=lambda d: bits_1_and_2(d[7])),
+          decd=lambda d: BITS_1_AND_2[d[7]]),
     Topic(name="Control/QuietMode/Level",
           help="Level of quiet mode (the higher the quieter)",
           enum=["Off", "Level 1", "Level 2", "Level 3"],
-          decd=lambda d: bits_3_to_5(d[7]),
+          decd=lambda d: BITS_3_TO_5[d[7]],
           encd=lambda d, mode: (7, (min(3, max(0, mode)) + 1) * 8)),
     Topic(name="Control/Reset",
           help="Perform a reset on the heat pump",
@@ -191,7 +408,7 @@ topics_heatpump = [
     Topic(name="Status/Defrosting",
           help="Defrosting currently ongoing or not",
           enum=["Disabled", "Enabled"],
-          decd=lambda d: bits_5_and_6(d[111]),
+          decd=lambda d: BITS_5_AND_6[d[111]],
           encd=lambda d, onoff: (8, 2 if onoff else 0)),
     Topic(name="Status/Error",
           help="Error code of the last error that happened",
@@ -211,21 +428,21 @@ topics_heatpump = [
           help="Outside ambient temperature measurement",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[142])),
+          decd=lambda d: INT_MINUS_128[d[142]]),
     Topic(name="Status/Temp/Target",
           help="Outlet target temperature",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[153])),
+          decd=lambda d: INT_MINUS_128[d[153]]),
     Topic(name="Status/ThreeWayValve",
           help="Switch state of three way valve, heating or DHW",
           enum=["Room", "DHW"],
-          decd=lambda d: bits_7_and_8(d[111])),
+          decd=lambda d: BITS_7_AND_8[d[111]]),
 
     Topic(name="Config/Zones/State",
           help="Zones connected to the device",
           enum=["Zone1 active", "Zone2 active", "Zone1 and zone2 active"],
-          decd=lambda d: bits_1_and_2(d[6]),
+          decd=lambda d: BITS_1_AND_2[d[6]],
           encd=lambda d, mode: (6, [64, 128, 192][mode] if mode < 3 else 0)),
 ]
 
@@ -233,25 +450,29 @@ topics_advanced = [
     Topic(name="Config/AltExternalSensor",
           help="If external outdoor sensor is used",
           enum=["Disabled", "Enabled"],
-          decd=lambda d: bits_3_and_4(d[20]),
-          encd=lambda d, onoff: (20, 32 if onoff else 16)),
+          decd=lambda d: BITS_3_AND_4[d[20]],
+          encd=lambda d, onoff: (20, 32 if onoff else 16),
+          stat=(20, 21)),
     Topic(name="Config/AntiFreezeMode",
           help="Is anti freeze mode enabled or disabled",
           enum=["Disabled", "Enabled"],
-          decd=lambda d: bits_5_and_6(d[20])),
+          decd=lambda d: BITS_5_AND_6[d[20]],
+          stat=(20, 21)),
     Topic(name="Config/ExternalPadHeater",
           help="If the external pad heater is enabled (if installed)",
           enum=["Disabled", "Type-A", "Type-B"],
-          decd=lambda d: bits_3_and_4(d[25]),
+          decd=lambda d: BITS_3_AND_4[d[25]],
           encd=lambda d, mode: (25, 48 if mode == 2 else 32 if mode == 1 else 16)),
     Topic(name="Config/LiquidType",
           help="Type of liquid in system",
           enum=["Water", "Glycol"],
-          decd=lambda d: bit_1(d[20])),
+          decd=lambda d: BIT_1[d[20]],
+          stat=(20, 21)),
     Topic(name="Config/OptionalPCB",
           help="If the optional PCB is enabled (if installed)",
           enum=["Disabled", "Enabled"],
-          decd=lambda d: bits_7_and_8(d[20])),
+          decd=lambda d: BITS_7_AND_8[d[20]],
+          stat=(20, 21)),
 
     Topic(name="Control/Optional/CompressorState",
           help="Turn compressor on or off",
@@ -284,42 +505,42 @@ topics_advanced = [
           help="Bypass Outlet temperature measurement",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[161])),
+          decd=lambda d: INT_MINUS_128[d[161]]),
     Topic(name="Status/Temp/Internal/Defrost",
           help="Defrost temperature",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[159])),
+          decd=lambda d: INT_MINUS_128[d[159]]),
     Topic(name="Status/Temp/Internal/Discharge",
           help="Discharge temperature measurement",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[155])),
+          decd=lambda d: INT_MINUS_128[d[155]]),
     Topic(name="Status/Temp/Internal/EvaOutlet",
           help="Eva Outlet temperature measurement",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[160])),
+          decd=lambda d: INT_MINUS_128[d[160]]),
     Topic(name="Status/Temp/Internal/IPM",
           help="Ipm temperature measurement",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[162])),
+          decd=lambda d: INT_MINUS_128[d[162]]),
     Topic(name="Status/Temp/Internal/InsidePipe",
           help="Inside pipe temperature measurement",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[157])),
+          decd=lambda d: INT_MINUS_128[d[157]]),
     Topic(name="Status/Temp/Internal/MainHexOutlet",
           help="Outlet 2, after heat exchanger water temperature measurement",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[154])),
+          decd=lambda d: INT_MINUS_128[d[154]]),
     Topic(name="Status/Temp/Internal/OutsidePipe",
           help="Outside pipe temperature measurement",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[158])),
+          decd=lambda d: INT_MINUS_128[d[158]]),
 ]
 
 topics_heating = [
@@ -327,37 +548,37 @@ topics_heating = [
           help="Aimed outlet-inlet temperature delta when heating",
           unit="K",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[84]),
+          decd=lambda d: INT_MINUS_128[d[84]],
           encd=lambda d, delta: (84, delta + 128)),
     Topic(name="Config/Heating/HolidayShiftTemp",
           help="Room heating Holiday shift temperature",
           unit="K",
           area=(-15, 15),
-          decd=lambda d: int_minus_128(d[43])),
+          decd=lambda d: INT_MINUS_128[d[43]]),
     Topic(name="Config/Heating/Mode",
           help="Compensation curve or Direct mode for heating",
           enum=["Comp. Curve", "Direct"],
-          decd=lambda d: bits_7_and_8(d[28])),
+          decd=lambda d: BITS_7_AND_8[d[28]]),
     Topic(name="Config/Heating/OffOutdoorTemp",
           help="Above this outdoor temperature all heating is turned off",
           unit="°C",
           area=(5, 35),
-          decd=lambda d: int_minus_128(d[83])),
+          decd=lambda d: INT_MINUS_128[d[83]]),
     Topic(name="Statistics/Energy/Consumption/Heat",
           help="Current electrical power consumption used for heating",
           unit="W",
           area=(-200, 50800),
-          decd=lambda d: get_energy(d[193])),
+          decd=lambda d: ENERGY[d[193]]),
     Topic(name="Statistics/Energy/Production/Heat",
           help="Current thermal heat power production used for heating",
           unit="W",
           area=(-200, 50800),
-          decd=lambda d: get_energy(d[194])),
+          decd=lambda d: ENERGY[d[194]]),
     Topic(name="Config/HeatToCoolTemp",
           help="Outdoor temperature to switch from heat to cool mode when in auto setting",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[95])),
+          decd=lambda d: INT_MINUS_128[d[95]]),
 ]
 
 topics_cooling = [
@@ -365,27 +586,27 @@ topics_cooling = [
           help="Aimed outlet-inlet temperature delta when cooling",
           unit="K",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[94]),
+          decd=lambda d: INT_MINUS_128[d[94]],
           encd=lambda d, delta: (94, delta + 128)),
     Topic(name="Config/Cooling/Mode",
           help="Compensation curve or Direct mode for cooling",
           enum=["Comp. Curve", "Direct"],
-          decd=lambda d: bits_5_and_6(d[28])),
+          decd=lambda d: BITS_5_AND_6[d[28]]),
     Topic(name="Statistics/Energy/Consumption/Cool",
           help="Electrical power consumption for cooling",
           unit="W",
           area=(-200, 50800),
-          decd=lambda d: get_energy(d[195])),
+          decd=lambda d: ENERGY[d[195]]),
     Topic(name="Statistics/Energy/Production/Cool",
           help="Thermal cooling power production",
           unit="W",
           area=(-200, 50800),
-          decd=lambda d: get_energy(d[196])),
+          decd=lambda d: ENERGY[d[196]]),
     Topic(name="Config/CoolToHeatTemp",
           help="Outdoor temperature to switch from cool to heat mode when in auto setting",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[96])),
+          decd=lambda d: INT_MINUS_128[d[96]]),
 ]
 
 topics_dhw = [
@@ -393,58 +614,59 @@ topics_dhw = [
           help="Hysteresis for DHW tank heating",
           unit="K",
           area=(-12, -2),
-          decd=lambda d: int_minus_128(d[99]),
+          decd=lambda d: INT_MINUS_128[d[99]],
           encd=lambda d, delta: (99, delta + 128)),
     Topic(name="Config/DHW/HolidayShiftTemp",
           help="Holiday shift temperature for DHW tank heating",
           unit="K",
           area=(-15, +15),
-          decd=lambda d: int_minus_128(d[44])),
+          decd=lambda d: INT_MINUS_128[d[44]]),
     Topic(name="Config/DHW/Installed",
           help="Buffer DHW tank installed",
           enum=["Disabled", "Enabled"],
-          decd=lambda d: bits_7_and_8(d[24])),
+          decd=lambda d: BITS_7_AND_8[d[24]],
+          stat=(24, 25)),
     Topic(name="Config/DHW/SterilizationMaxTime",
           help="Sterilisation maximum time",
           unit="min",
           area=(-1, 254),
-          decd=lambda d: int_minus_1(d[101])),
+          decd=lambda d: INT_MINUS_1[d[101]]),
     Topic(name="Config/DHW/SterilizationTemp",
           help="Sterilisation temperature",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[100])),
+          decd=lambda d: INT_MINUS_128[d[100]]),
     Topic(name="Control/DHW/Force",
           help="Enforce DHW heating operation to happen now",
           enum=["Disabled", "Enabled"],
-          decd=lambda d: bits_1_and_2(d[4]),
+          decd=lambda d: BITS_1_AND_2[d[4]],
           encd=lambda d, onoff: (4, 128 if onoff else 64)),
     Topic(name="Control/DHW/Sterilization",
           help="Sterilisation state",
           enum=["Inactive", "Active"],
-          decd=lambda d: bits_5_and_6(d[117]),
+          decd=lambda d: BITS_5_AND_6[d[117]],
           encd=lambda d, onoff: (8, 4 if onoff else 0)),
     Topic(name="Control/DHW/TargetTemp",
           help="Water tank target temperature",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[42]),
+          decd=lambda d: INT_MINUS_128[d[42]],
           encd=lambda d, temperature: (42, temperature + 128)),
     Topic(name="Status/Temp/DHW",
           help="Water tank temperature measurement",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[141])),
+          decd=lambda d: INT_MINUS_128[d[141]]),
     Topic(name="Statistics/Energy/Consumption/DHW",
           help="Electrical power consumption for DHW",
           unit="W",
           area=(-200, 50800),
-          decd=lambda d: get_energy(d[197])),
+          decd=lambda d: ENERGY[d[197]]),
     Topic(name="Statistics/Energy/Production/DHW",
           help="Thermal heating power production for DHW",
           unit="W",
           area=(-200, 50800),
-          decd=lambda d: get_energy(d[198])),
+          decd=lambda d: ENERGY[d[198]]),
 ]
 
 topics_zone_1 = [
@@ -466,62 +688,62 @@ topics_zone_1 = [
           help="Cool Requested shift temp (-5 to 5) or direct cool temp (5 to 20)",
           unit="°C",
           area=(-5, 20),
-          decd=lambda d: int_minus_128(d[39]),
+          decd=lambda d: INT_MINUS_128[d[39]],
           encd=lambda d, temperature: (39, temperature + 128)),
     Topic(name="Config/Zones/1/CoolCurve/OutsideHigh",
           help="Highest outside temperature on the cooling curve",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[89]),
+          decd=lambda d: INT_MINUS_128[d[89]],
           encd=lambda d, temp: (89, temp + 128)),
     Topic(name="Config/Zones/1/CoolCurve/OutsideLow",
           help="Lowest outside temperature on the cooling curve",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[88]),
+          decd=lambda d: INT_MINUS_128[d[88]],
           encd=lambda d, temp: (88, temp + 128)),
     Topic(name="Config/Zones/1/CoolCurve/TargetHigh",
           help="Target temperature at highest point on the cooling curve",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[86]),
+          decd=lambda d: INT_MINUS_128[d[86]],
           encd=lambda d, temp: (86, temp + 128)),
     Topic(name="Config/Zones/1/CoolCurve/TargetLow",
           help="Target temperature at highest point on the cooling curve",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[87]),
+          decd=lambda d: INT_MINUS_128[d[87]],
           encd=lambda d, temp: (87, temp + 128)),
 
     Topic(name="Config/Zones/1/Heat/RequestTemp",
           help="Heat Requested shift temp (-5 to 5) or direct heat temp (20 to max)",
           unit="°C",
           area=(-5, 127),
-          decd=lambda d: int_minus_128(d[38]),
+          decd=lambda d: INT_MINUS_128[d[38]],
           encd=lambda d, temperature: (38, temperature + 128)),
     Topic(name="Config/Zones/1/HeatCurve/OutsideHigh",
           help="Highest outside temperature on the heating curve",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[78]),
+          decd=lambda d: INT_MINUS_128[d[78]],
           encd=lambda d, temp: (78, temp + 128)),
     Topic(name="Config/Zones/1/HeatCurve/OutsideLow",
           help="Lowest outside temperature on the heating curve",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[77]),
+          decd=lambda d: INT_MINUS_128[d[77]],
           encd=lambda d, temp: (77, temp + 128)),
     Topic(name="Config/Zones/1/HeatCurve/TargetHigh",
           help="Target temperature at highest point on the heating curve",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[75]),
+          decd=lambda d: INT_MINUS_128[d[75]],
           encd=lambda d, temp: (75, temp + 128)),
     Topic(name="Config/Zones/1/HeatCurve/TargetLow",
           help="Target temperature at lowest point on the heating curve",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[76]),
+          decd=lambda d: INT_MINUS_128[d[76]],
           encd=lambda d, temp: (76, temp + 128)),
     Topic(name="Control/Optional/Sensors/Zones/1/RoomTemp",
           help="Zone 1 room temperature sensor reading",
@@ -545,22 +767,22 @@ topics_zone_1 = [
           help="Zone 1 actual temperature",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[139])),
+          decd=lambda d: INT_MINUS_128[d[139]]),
     Topic(name="Status/Temp/Zones/1/Outlet",
           help="Zone 1 water outlet temperature measurement",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[145])),
+          decd=lambda d: INT_MINUS_128[d[145]]),
     Topic(name="Status/Temp/Zones/1/OutletTarget",
           help="Zone 1 water target temperature",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[147])),
+          decd=lambda d: INT_MINUS_128[d[147]]),
     Topic(name="Status/Temp/RoomThermostat",
           help="Remote control thermostat temperature measurement",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[156])),
+          decd=lambda d: INT_MINUS_128[d[156]]),
 ]
 
 topics_zone_2 = [
@@ -582,61 +804,61 @@ topics_zone_2 = [
           help="Cool Requested shift temp (-5 to 5) or direct cool temp (5 to 20)",
           unit="°C",
           area=(-5, 20),
-          decd=lambda d: int_minus_128(d[41]),
+          decd=lambda d: INT_MINUS_128[d[41]],
           encd=lambda d, temperature: (41, temperature + 128)),
     Topic(name="Config/Zones/2/CoolCurve/OutsideHigh",
           help="Highest outside temperature on the cooling curve",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[93]),
+          decd=lambda d: INT_MINUS_128[d[93]],
           encd=lambda d, temp: (93, temp + 128)),
     Topic(name="Config/Zones/2/CoolCurve/OutsideLow",
           help="Lowest outside temperature on the cooling curve",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[92]),
+          decd=lambda d: INT_MINUS_128[d[92]],
           encd=lambda d, temp: (92, temp + 128)),
     Topic(name="Config/Zones/2/CoolCurve/TargetHigh",
           help="Target temperature at highest point on the cooling curve",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[90]),
+          decd=lambda d: INT_MINUS_128[d[90]],
           encd=lambda d, temp: (90, temp + 128)),
     Topic(name="Config/Zones/2/CoolCurve/TargetLow",
           help="Target temperature at lowest point on the cooling curve",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[91]),
+          decd=lambda d: INT_MINUS_128[d[91]],
           encd=lambda d, temp: (91, temp + 128)),
     Topic(name="Config/Zones/2/Heat/RequestTemp",
           help="Heat Requested shift temp (-5 to 5) or direct heat temp (20 to max)",
           unit="°C",
           area=(-5, 127),
-          decd=lambda d: int_minus_128(d[40]),
+          decd=lambda d: INT_MINUS_128[d[40]],
           encd=lambda d, temperature: (40, temperature + 128)),
     Topic(name="Config/Zones/2/HeatCurve/OutsideHigh",
           help="Highest outside temperature on the heating curve",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[82]),
+          decd=lambda d: INT_MINUS_128[d[82]],
           encd=lambda d, temp: (82, temp + 128)),
     Topic(name="Config/Zones/2/HeatCurve/OutsideLow",
           help="Lowest outside temperature on the heating curve",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[81]),
+          decd=lambda d: INT_MINUS_128[d[81]],
           encd=lambda d, temp: (81, temp + 128)),
     Topic(name="Config/Zones/2/HeatCurve/TargetHigh",
           help="Target temperature at highest point on the heating curve",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[79]),
+          decd=lambda d: INT_MINUS_128[d[79]],
           encd=lambda d, temp: (79, temp + 128)),
     Topic(name="Config/Zones/2/HeatCurve/TargetLow",
           help="Target temperature at lowest point on the heating curve",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[80]),
+          decd=lambda d: INT_MINUS_128[d[80]],
           encd=lambda d, temp: (80, temp + 128)),
     Topic(name="Control/Optional/Sensors/Zones/2/RoomTemp",
           help="Zone 2 room temperature sensor reading",
@@ -660,17 +882,17 @@ topics_zone_2 = [
           help="Zone 2 actual temperature",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[140])),
+          decd=lambda d: INT_MINUS_128[d[140]]),
     Topic(name="Status/Temp/Zones/2/Outlet",
           help="Zone 2 water outlet temperature measurement",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[146])),
+          decd=lambda d: INT_MINUS_128[d[146]]),
     Topic(name="Status/Temp/Zones/2/OutletTarget",
           help="Zone 2 water target temperature",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[148])),
+          decd=lambda d: INT_MINUS_128[d[148]]),
 ]
 
 topics_pool = [
@@ -689,7 +911,7 @@ topics_pool = [
           help="Actual pool temperature measurement",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[151])),
+          decd=lambda d: INT_MINUS_128[d[151]]),
 ]
 
 topics_solar = [
@@ -702,26 +924,27 @@ topics_solar = [
           help="Solar frost protection temperature",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[63])),
+          decd=lambda d: INT_MINUS_128[d[63]]),
     Topic(name="Config/Solar/HighLimit",
           help="Solar max temperature limit",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[64])),
+          decd=lambda d: INT_MINUS_128[d[64]]),
     Topic(name="Config/Solar/Mode",
           help="Solar mode (disabled, to buffer, to DHW)",
           enum=["Disabled", "Buffer", "DHW"],
-          decd=lambda d: bits_3_and_4(d[24])),
+          decd=lambda d: BITS_3_AND_4[d[24]],
+          stat=(24, 25)),
     Topic(name="Config/Solar/OffDelta",
           help="Solar heating delta off",
           unit="K",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[62])),
+          decd=lambda d: INT_MINUS_128[d[62]]),
     Topic(name="Config/Solar/OnDelta",
           help="Solar heating delta on",
           unit="K",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[61])),
+          decd=lambda d: INT_MINUS_128[d[61]]),
     Topic(name="Control/Optional/Sensors/SolarTemp",
           help="Solar water temperature sensor reading",
           area=(NTC_MAPPING[-1], NTC_MAPPING[0]),
@@ -732,7 +955,7 @@ topics_solar = [
           help="Actual solar temperature measurement",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[150])),
+          decd=lambda d: INT_MINUS_128[d[150]]),
 ]
 
 topics_buffer = [
@@ -740,12 +963,13 @@ topics_buffer = [
           help="Delta of buffer tank setting",
           unit="K",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[59]),
+          decd=lambda d: INT_MINUS_128[d[59]],
           encd=lambda d, delta: (59, delta + 128)),
     Topic(name="Config/Buffer/Installed",
           help="Buffer tank installed",
           enum=["Disabled", "Enabled"],
-          decd=lambda d: bits_5_and_6(d[24])),
+          decd=lambda d: BITS_5_AND_6[d[24]],
+          stat=(24, 25)),
     Topic(name="Control/Optional/Sensors/BufferTemp",
           help="Buffer temperature sensor reading",
           area=(NTC_MAPPING[-1], NTC_MAPPING[0]),
@@ -756,28 +980,28 @@ topics_buffer = [
           help="Actual buffer temperature measurement",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[149])),
+          decd=lambda d: INT_MINUS_128[d[149]]),
 ]
 
 topics_pump = [
     Topic(name="Config/Pump/FlowRateMode",
           help="Mode of pump control",
           enum=["DeltaT", "Max flow"],
-          decd=lambda d: bits_3_and_4(d[29])),
+          decd=lambda d: BITS_3_AND_4[d[29]]),
     Topic(name="Config/Pump/MaxDuty",
           help="Maximum pump duty configured",
           area=(-1, 254),
-          decd=lambda d: int_minus_1(d[45]),
+          decd=lambda d: INT_MINUS_1[d[45]],
           encd=lambda d, duty: (45, duty + 1)),
     Topic(name="Config/Pump/ServiceMode",
           help="Set Water Pump to service mode, max speed",
           enum=["Off", "On"],
-          decd=lambda d: 1 if bits_5_and_6(d[4]) == 2 else 0,
+          decd=lambda d: 1 if BITS_5_AND_6[d[4]] == 2 else 0,
           encd=lambda d, onoff: (4, 32 if onoff else 16)),
     Topic(name="Status/Pump/Duty",
           help="Current pump duty",
           area=(-1, 254),
-          decd=lambda d: int_minus_1(d[172])),
+          decd=lambda d: INT_MINUS_1[d[172]]),
     Topic(name="Status/Pump/Flow",
           help="Current pump flow rate",
           unit="l/min",
@@ -787,40 +1011,40 @@ topics_pump = [
           help="Pump rotation speed",
           unit="r/min",
           area=(-50, 12700),
-          decd=lambda d: int_minus_1_times_50(d[171])),
+          decd=lambda d: INT_MINUS_1_TIMES_50[d[171]]),
 ]
 
 topics_heating_rod = [
     Topic(name="Config/HeatingRod/DHW",
           help="When enabled, backup/booster heater can be used for DHW heating",
           enum=["Blocked", "Free"],
-          decd=lambda d: bits_5_and_6(d[9])),
+          decd=lambda d: BITS_5_AND_6[d[9]]),
     Topic(name="Config/HeatingRod/DelayTime",
           help="Heater delay time (J-series only)",
           unit="min",
           area=(-1, 254),
-          decd=lambda d: int_minus_1(d[104]),
+          decd=lambda d: INT_MINUS_1[d[104]],
           encd=lambda d, time: (104, time + 1)),
     Topic(name="Config/HeatingRod/OnOutdoorTemp",
           help="Below this temperature the backup heating rod is allowed to be used by heatpump heating logic",
           unit="°C",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[85])),
+          decd=lambda d: INT_MINUS_128[d[85]]),
     Topic(name="Config/HeatingRod/Room",
           help="When enabled, backup/booster heater can be used for room heating",
           enum=["Blocked", "Free"],
-          decd=lambda d: bits_7_and_8(d[9])),
+          decd=lambda d: BITS_7_AND_8[d[9]]),
     Topic(name="Config/HeatingRod/StartDelta",
           help="Heater start delta (J-series only)",
           unit="K",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[105]),
+          decd=lambda d: INT_MINUS_128[d[105]],
           encd=lambda d, delta: (105, delta + 128)),
     Topic(name="Config/HeatingRod/StopDelta",
           help="Heater stop delta (J-series only)",
           unit="K",
           area=(-128, 127),
-          decd=lambda d: int_minus_128(d[106]),
+          decd=lambda d: INT_MINUS_128[d[106]],
           encd=lambda d, delta: (106, delta + 128)),
     Topic(name="Statistics/Usage/HeatingRod/DHW",
           help="Electric heater operating time for DHW",
@@ -835,15 +1059,15 @@ topics_heating_rod = [
     Topic(name="Status/HeatingRod/Enforce",
           help="Force heating rod",
           enum=["Inactive", "Active"],
-          decd=lambda d: bits_5_and_6(d[5])),
+          decd=lambda d: BITS_5_AND_6[d[5]]),
     Topic(name="Status/HeatingRod/External",
           help="External backup heater state",
           enum=["Inactive", "Active"],
-          decd=lambda d: bits_5_and_6(d[112])),
+          decd=lambda d: BITS_5_AND_6[d[112]]),
     Topic(name="Status/HeatingRod/Internal",
           help="Internal backup heater state",
           enum=["Inactive", "Active"],
-          decd=lambda d: bits_7_and_8(d[112])),
+          decd=lambda d: BITS_7_AND_8[d[112]]),
 ]
 
 topics_fans = [
@@ -851,12 +1075,12 @@ topics_fans = [
           help="Fan 1 Motor rotation speed",
           unit="r/min",
           area=(-10, 2540),
-          decd=lambda d: int_minus_1_times_10(d[173])),
+          decd=lambda d: INT_MINUS_1_TIMES_10[d[173]]),
     Topic(name="Status/Fan/2/Speed",
           help="Fan 2 Motor rotation speed",
           unit="r/min",
           area=(-10, 2540),
-          decd=lambda d: int_minus_1_times_10(d[174])),
+          decd=lambda d: INT_MINUS_1_TIMES_10[d[174]]),
 ]
 
 topics_compressor = [
@@ -864,12 +1088,12 @@ topics_compressor = [
           help="Compressor electrical current",
           unit="A",
           area=(-0.2, 50.8),
-          decd=lambda d: int_minus_1_div_5(d[165])),
+          decd=lambda d: INT_MINUS_1_DIV_5[d[165]]),
     Topic(name="Status/Compressor/Freq",
           help="Compressor frequency",
           unit="Hz",
           area=(-1, 254),
-          decd=lambda d: int_minus_1(d[166])),
+          decd=lambda d: INT_MINUS_1[d[166]]),
     Topic(name="Statistics/Usage/Runtime",
           unit="h",
           help="Total runtime of the compressor",
@@ -883,46 +1107,114 @@ topics_compressor = [
           help="High pressure",
           unit="Kgf/cm2",
           area=(-0.2, 50.8),
-          decd=lambda d: int_minus_1_div_5(d[163])),
+          decd=lambda d: INT_MINUS_1_DIV_5[d[163]]),
     Topic(name="Status/Pressure/Low",
           help="Low pressure",
           unit="Kgf/cm2",
           area=(-1, 254),
-          decd=lambda d: int_minus_1(d[164])),
+          decd=lambda d: INT_MINUS_1[d[164]]),
+]
+
+# heat capacity of water in J/(l*K) divided by 60 s, turns l/min times K into W
+water_heat_flow = 4186 / 60
+
+topics_derived = [
+    DerivedTopic(name="Derived/Temp/Delta",
+                 help="Measured outlet-inlet temperature delta",
+                 unit="K",
+                 inputs=["Status/Temp/Outlet", "Status/Temp/Inlet"],
+                 fnc=lambda outlet, inlet: round(outlet - inlet, 2)),
+    DerivedTopic(name="Derived/Power/Thermal",
+                 help="Thermal power from pump flow and outlet-inlet temperature delta",
+                 unit="W",
+                 inputs=["Status/Pump/Flow", "Derived/Temp/Delta"],
+                 fnc=lambda flow, delta: round(flow * delta * water_heat_flow)),
+    DerivedTopic(name="Derived/Energy/Consumption",
+                 help="Total electrical power consumption",
+                 unit="W",
+                 inputs=["Statistics/Energy/Consumption/Heat", "Statistics/Energy/Consumption/Cool",
+                         "Statistics/Energy/Consumption/DHW"],
+                 fnc=lambda heat, cool, dhw: max(heat, 0) + max(cool, 0) + max(dhw, 0)),
+    DerivedTopic(name="Derived/COP/Heat",
+                 help="Coefficient of performance for heating as reported by the heat pump",
+                 inputs=["Statistics/Energy/Production/Heat", "Statistics/Energy/Consumption/Heat"],
+                 fnc=lambda production, consumption: cop(production, consumption)),
+    DerivedTopic(name="Derived/COP/Cool",
+                 help="Coefficient of performance for cooling as reported by the heat pump",
+                 inputs=["Statistics/Energy/Production/Cool", "Statistics/Energy/Consumption/Cool"],
+                 fnc=lambda production, consumption: cop(production, consumption)),
+    DerivedTopic(name="Derived/COP/DHW",
+                 help="Coefficient of performance for DHW as reported by the heat pump",
+                 inputs=["Statistics/Energy/Production/DHW", "Statistics/Energy/Consumption/DHW"],
+                 fnc=lambda production, consumption: cop(production, consumption)),
+    DerivedTopic(name="Derived/COP/Measured",
+                 help="Coefficient of performance from measured thermal power and total consumption",
+                 inputs=["Derived/Power/Thermal", "Derived/Energy/Consumption"],
+                 fnc=lambda production, consumption: cop(abs(production), consumption)),
 ]
 
 topics = \
     topics_heatpump + topics_advanced + topics_heating + topics_cooling + topics_dhw + \
     topics_zone_1 + topics_zone_2 + topics_pool + topics_solar + topics_buffer + topics_compressor + \
-    topics_pump + topics_heating_rod + topics_fans
+    topics_pump + topics_heating_rod + topics_fans + topics_derived
+
+state = register_topics(topics)
+registry = TopicRegistry(topics)
 
 
-def decode_and_update_topic(data: []) -> bool:
+def decode_and_update_topic(data: [], changed: [] = None, device: TopicRegistry = None) -> bool:
     if not len(data) in [20, 203]:
         logging.info(F"topics: invalid data len {len(data)}")
+        metrics.frames_invalid.inc("length")
         return False
 
     if not valid_checksum(data):
         logging.info(F"topics: invalid checksum received {checksum(data[:-1])} != {data[-1]}")
+        metrics.frames_invalid.inc("checksum")
         return False
 
-    for topic in topics:
-        topic.decode(data)
+    if device is None:
+        device = registry
+    sources = device.state.sources
+    updated = []
+
+    for (start, end), static_topics in device.static_partition(len(data)).items():
+        source = bytes(data[start:end])
+        if sources.get((start, end)) != source:
+            sources[(start, end)] = source
+            for topic in static_topics:
+                if topic.update(topic.decode_fnc(data)):
+                    updated.append(topic)
+
+    for topic in device.partition(len(data)):
+        if topic.update(topic.decode_fnc(data)):
+            updated.append(topic)
+
+    if len(updated) > 0:
+        updated += device.derive(updated)
+
+    if changed is not None:
+        changed += updated
 
     return True
 
 
+def reset_topics():
+    # forget all decoded values, e.g. before decoding an unrelated stretch of recorded frames
+    global state
+    state = register_topics(topics)
+
+
 def find_topic(name: str):
-    for topic in topics:
-        if topic.name.lower() == name.lower():
-            return topic
-    return None
+    return registry.find(name)
+
+
+def query_topics(pattern: str) -> []:
+    return registry.query(pattern)
 
 
 def checksum(data: []) -> int:
-    chk = 0
-    for b in data:
-        chk += b
+    chk = sum(data)
     chk = (chk ^ 0xFF) + 0x01
     return chk & 0xFF
 
@@ -987,27 +1279,7 @@ def int_minus_1_times_50(value):
 
 
 def get_op_mode(value):
-    op_mode = int(value & 0b111111)
-    if op_mode == 18:
-        return "0"
-    elif op_mode == 19:
-        return "1"
-    elif op_mode == 25:
-        return "2"
-    elif op_mode == 33:
-        return "3"
-    elif op_mode == 34:
-        return "4"
-    elif op_mode == 35:
-        return "5"
-    elif op_mode == 41:
-        return "6"
-    elif op_mode == 26:
-        return "7"
-    elif op_mode == 42:
-        return "8"
-    else:
-        return "-1"
+    return OP_MODE[value]
 
 
 def get_energy(value):
@@ -1015,12 +1287,11 @@ def get_energy(value):
 
 
 def get_model(data):
-    model = [data[129], data[130], data[131], data[132], data[133], data[134], data[135], data[136], data[137],
-             data[138]]
-    for i in range(len(descriptions.knownModels)):
-        if model == descriptions.knownModels[i]:
-            return i
-    return -1
+    return descriptions.knownModelIndex.get(bytes(data[129:139]), -1)
+
+
+def cop(production, consumption):
+    return round(production / consumption, 2) if consumption > 0 else None
 
 
 def get_pump_flow(data):
@@ -1042,7 +1313,7 @@ def get_error_info(data):
 
 
 def get_inlet_temp(data):
-    value = float(int_minus_128(data[143]))
+    value = float(INT_MINUS_128[data[143]])
     fractional = int(data[118] & 0b111)
     if fractional == 2:
         value += .25
@@ -1054,7 +1325,7 @@ def get_inlet_temp(data):
 
 
 def get_outlet_temp(data):
-    value = float(int_minus_128(data[144]))
+    value = float(INT_MINUS_128[data[144]])
     fractional = int((data[118] >> 3) & 0b111)
     if fractional == 2:
         value += .25
@@ -1070,15 +1341,32 @@ def update_byte(current, val, base, bit):
 
 
 def ntc_of_temp(temp: int) -> int:
-    for idx, val in enumerate(NTC_MAPPING):
-        if temp >= val:
-            return idx
-    return 255
+    idx = floor(temp) - NTC_MAPPING[-1]
+    if idx < 0:
+        return 255
+    return NTC_OF_TEMP[idx] if idx < len(NTC_OF_TEMP) else 0
 
 
 def is_int(value: any) -> bool:
     try:
         int(value)
         return True
-    except ValueError:
+    except (TypeError, ValueError):
         return False
+
+
+# per byte value lookup tables of the helpers above, decoders index these instead of calling the helpers
+BIT_1: (int,) = tuple(bit_1(value) for value in range(256))
+BITS_1_AND_2: (int,) = tuple(bits_1_and_2(value) for value in range(256))
+BITS_3_AND_4: (int,) = tuple(bits_3_and_4(value) for value in range(256))
+BITS_5_AND_6: (int,) = tuple(bits_5_and_6(value) for value in range(256))
+BITS_7_AND_8: (int,) = tuple(bits_7_and_8(value) for value in range(256))
+BITS_3_TO_5: (int,) = tuple(bits_3_to_5(value) for value in range(256))
+LEFT_5_BITS: (int,) = tuple(left_5_bits(value) for value in range(256))
+RIGHT_3_BITS: (int,) = tuple(right_3_bits(value) for value in range(256))
+INT_MINUS_1: (int,) = tuple(int_minus_1(value) for value in range(256))
+INT_MINUS_128: (int,) = tuple(int_minus_128(value) for value in range(256))
+INT_MINUS_1_DIV_5: (float,) = tuple(int_minus_1_div_5(value) for value in range(256))
+INT_MINUS_1_TIMES_10: (int,) = tuple(int_minus_1_times_10(value) for value in range(256))
+INT_MINUS_1_TIMES_50: (int,) = tuple(int_minus_1_times_50(value) for value in range(256))
+ENERGY: (int,) = tuple(get_energy(value) for value in range(256))
@@ -0,0 +1,298 @@
+import logging
+import os
+import socket
+import struct
+import tempfile
+import threading
+
+from sinks import Sink
+from topics import Topic, topics
+
+default_socket_path = os.path.join(tempfile.gettempdir(), "pysha.sock")
+
+# every message is a little endian u32 length followed by that many bytes: u8 opcode, then the body.
+# Topics are addressed by id, the index of the name in the NAMES answer.
+NAMES = 0x01  # -> NAMES_RESULT: topic names separated by newlines
+GET = 0x02  # u16 count, count * u16 id -> VALUES
+SUBSCRIBE = 0x03  # u16 count, count * u16 id, no ids for all -> SUBSCRIBED: u16 count, then UPDATE pushes
+SET = 0x04  # u16 count, count * (u16 id, value) -> SET_RESULT: u16 count, count * (u8 status, u32 command id)
+
+NAMES_RESULT = 0x81
+VALUES = 0x82
+SUBSCRIBED = 0x83
+UPDATE = 0x84  # u16 count, count * entry, pushed after every frame that changed a subscribed topic
+SET_RESULT = 0x85
+ERROR = 0xFF  # utf-8 message
+
+# entry: u16 id, u64 change sequence, value; value: u8 type, then i64, f64 or u8 length + utf-8 text
+NONE = 0
+INT = 1
+FLOAT = 2
+TEXT = 3
+
+SET_OK = 0
+SET_REJECTED = 1
+
+length_prefix = struct.Struct("<I")
+max_message = 65536
+# a client that does not take a push within this many seconds is dropped
+send_timeout = 1.0
+
+
+def encode_value(value: any) -> bytes:
+    if value is None:
+        return bytes([NONE])
+    if isinstance(value, str):
+        text = value.encode("utf-8")[:255]
+        return struct.pack("<BB", TEXT, len(text)) + text
+    if isinstance(value, int):
+        return struct.pack("<Bq", INT, value)
+    return struct.pack("<Bd", FLOAT, value)
+
+
+def decode_value(data: bytes, offset: int) -> (any, int):
+    kind = data[offset]
+    if kind == INT:
+        return struct.unpack_from("<q", data, offset + 1)[0], offset + 9
+    if kind == FLOAT:
+        return struct.unpack_from("<d", data, offset + 1)[0], offset + 9
+    if kind == TEXT:
+        length = data[offset + 1]
+        return data[offset + 2:offset + 2 + length].decode("utf-8"), offset + 2 + length
+    return None, offset + 1
+
+
+def encode_entries(entries: [Topic]) -> bytes:
+    return struct.pack("<H", len(entries)) + b"".join(
+        struct.pack("<HQ", topic.id, topic.sequence) + encode_value(topic.value) for topic in entries)
+
+
+def decode_entries(data: bytes, offset: int = 0) -> [(int, int, any)]:
+    (count,) = struct.unpack_from("<H", data, offset)
+    offset += 2
+    entries = []
+    for _ in range(count):
+        (topic_id, sequence) = struct.unpack_from("<HQ", data, offset)
+        (value, offset) = decode_value(data, offset + 10)
+        entries.append((topic_id, sequence, value))
+    return entries
+
+
+def decode_ids(data: bytes, offset: int = 0) -> [int]:
+    (count,) = struct.unpack_from("<H", data, offset)
+    return list(struct.unpack_from(F"<{count}H", data, offset + 2))
+
+
+def send_message(connection: socket.socket, opcode: int, body: bytes = b""):
+    connection.sendall(length_prefix.pack(len(body) + 1) + bytes([opcode]) + body)
+
+
+def receive_exactly(connection: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed.")
+        data += chunk
+    return bytes(data)
+
+
+def receive_message(connection: socket.socket) -> (int, bytes):
+    (size,) = length_prefix.unpack(receive_exactly(connection, length_prefix.size))
+    if size == 0 or size > max_message:
+        raise ConnectionError(F"Invalid message length {size}.")
+    data = receive_exactly(connection, size)
+    return data[0], data[1:]
+
+
+class Client:
+    # one connection of the server, subscriptions are pushed from the thread that dispatches to the sink
+    def __init__(self, connection: socket.socket):
+        self.connection = connection
+        # only sends time out, the connection stays blocking for the requests read by its own thread
+        (seconds, fraction) = divmod(send_timeout, 1)
+        connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO,
+                              struct.pack("ll", int(seconds), int(fraction * 1000000)))
+        self.lock = threading.Lock()
+        # False until the client subscribes, None for all topics, otherwise the set of topic ids
+        self.subscribed = False
+
+    def send(self, opcode: int, body: bytes = b""):
+        with self.lock:
+            send_message(self.connection, opcode, body)
+
+    def drop(self):
+        # wakes up the thread serving the client, which removes it
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class UdsServer(Sink):
+    # local binary API on a unix domain socket, added to the heat pump as a sink for the subscription pushes
+    name = "uds"
+
+    def __init__(self, path: str = default_socket_path):
+        super().__init__()
+        self.path = path
+        self.clients = []
+        self.names = "\n".join(topic.name for topic in topics).encode("utf-8")
+        if os.path.exists(path):
+            os.unlink(path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen()
+        self.running = True
+        threading.Thread(target=self.accept, name="uds", daemon=True).start()
+        logging.info(F"uds: listening on {path}")
+
+    def accept(self):
+        while self.running:
+            try:
+                (connection, _) = self.server.accept()
+            except OSError:
+                break
+            client = Client(connection)
+            self.clients.append(client)
+            threading.Thread(target=self.serve, args=(client,), name="uds-client", daemon=True).start()
+
+    def serve(self, client: Client):
+        try:
+            while self.running:
+                (opcode, body) = receive_message(client.connection)
+                try:
+                    self.handle(client, opcode, body)
+                except (struct.error, IndexError, ValueError, UnicodeDecodeError) as err:
+                    client.send(ERROR, F"Invalid request {opcode}: {err}".encode("utf-8"))
+        except (ConnectionError, OSError) as err:
+            logging.debug(F"uds: client gone, {err}")
+        finally:
+            self.clients.remove(client)
+            client.connection.close()
+
+    def handle(self, client: Client, opcode: int, body: bytes):
+        if opcode == NAMES:
+            client.send(NAMES_RESULT, self.names)
+        elif opcode == GET:
+            client.send(VALUES, encode_entries([self.topic(topic_id) for topic_id in decode_ids(body)]))
+        elif opcode == SUBSCRIBE:
+            ids = decode_ids(body)
+            client.subscribed = set(self.topic(topic_id).id for topic_id in ids) if len(ids) > 0 else None
+            client.send(SUBSCRIBED, struct.pack("<H", len(ids)))
+        elif opcode == SET:
+            client.send(SET_RESULT, self.set(body))
+        else:
+            client.send(ERROR, F"Unknown request {opcode}".encode("utf-8"))
+
+    def topic(self, topic_id: int) -> Topic:
+        if not 0 <= topic_id < len(topics):
+            raise ValueError(F"Topic id {topic_id} does not exist.")
+        return topics[topic_id]
+
+    def set(self, body: bytes) -> bytes:
+        # every value takes the same validation path as commands from MQTT or D-Bus
+        (count,) = struct.unpack_from("<H", body)
+        offset = 2
+        results = []
+        for _ in range(count):
+            (topic_id,) = struct.unpack_from("<H", body, offset)
+            (value, offset) = decode_value(body, offset + 2)
+            try:
+                if value is None:
+                    raise ValueError(F"Topic id {topic_id} cannot be set to no value.")
+                command = self.heatpump.command(self.topic(topic_id).name, value)
+                results.append(struct.pack("<BI", SET_OK, command.id))
+            except ValueError as e:
+                logging.warning(F"uds: {e}")
+                results.append(struct.pack("<BI", SET_REJECTED, 0))
+        return struct.pack("<H", count) + b"".join(results)
+
+    def dispatch(self, candidates: [Topic]):
+        # one push per client and batch of the queue with all changes since the last push
+        changed = self.undelivered(candidates)
+        if len(changed) == 0:
+            return
+        for topic in changed:
+            self.delivered[topic.id] = topic.sequence
+
+        for client in list(self.clients):
+            if client.subscribed is False:
+                continue
+            entries = changed if client.subscribed is None else \
+                [topic for topic in changed if topic.id in client.subscribed]
+            if len(entries) == 0:
+                continue
+            try:
+                client.send(UPDATE, encode_entries(entries))
+            except OSError as err:
+                # a partial message cannot be taken back, the client would not find the next one
+                logging.warning(F"uds: dropping client, push failed, {err}")
+                client.drop()
+
+    def close(self):
+        self.running = False
+        self.server.close()
+        for client in list(self.clients):
+            client.connection.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class UdsClient:
+    # blocking client for the protocol above
+    def __init__(self, path: str = default_socket_path):
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.connection.connect(path)
+        self.pushed = []
+        self.names = self.request(NAMES)[1].decode("utf-8").split("\n")
+        self.ids = {name.lower(): topic_id for topic_id, name in enumerate(self.names)}
+
+    def id(self, name: str) -> int:
+        topic_id = self.ids.get(name.lower())
+        if topic_id is None:
+            raise KeyError(F"Topic {name} does not exist.")
+        return topic_id
+
+    def request(self, opcode: int, body: bytes = b"") -> (int, bytes):
+        send_message(self.connection, opcode, body)
+        while True:
+            (answer, data) = receive_message(self.connection)
+            if answer == UPDATE:
+                # pushes that arrive while waiting for an answer are kept for updates()
+                self.pushed.append(data)
+                continue
+            if answer == ERROR:
+                raise ValueError(data.decode("utf-8"))
+            return answer, data
+
+    def get(self, names: [str]) -> {str: any}:
+        ids = [self.id(name) for name in names]
+        (_, data) = self.request(GET, struct.pack(F"<H{len(ids)}H", len(ids), *ids))
+        return {self.names[topic_id]: value for (topic_id, _, value) in decode_entries(data)}
+
+    def subscribe(self, names: [str] = None):
+        ids = [self.id(name) for name in names or []]
+        self.request(SUBSCRIBE, struct.pack(F"<H{len(ids)}H", len(ids), *ids))
+
+    def set(self, values: {str: any}) -> [(bool, int)]:
+        body = struct.pack("<H", len(values)) + b"".join(
+            struct.pack("<H", self.id(name)) + encode_value(value) for name, value in values.items())
+        (_, data) = self.request(SET, body)
+        (count,) = struct.unpack_from("<H", data)
+        return [(status == SET_OK, command_id) for (status, command_id) in struct.iter_unpack("<BI", data[2:])][:count]
+
+    def updates(self):
+        # yields {name: value} for every push of the subscription
+        while True:
+            data = self.pushed.pop(0) if self.pushed else self.read_update()
+            yield {self.names[topic_id]: value for (topic_id, _, value) in decode_entries(data)}
+
+    def read_update(self) -> bytes:
+        while True:
+            (answer, data) = receive_message(self.connection)
+            if answer == UPDATE:
+                return data
+
+    def close(self):
+        self.connection.close()
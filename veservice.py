@@ -0,0 +1,45 @@
+import logging
+import os
+import platform
+import sys
+
+from topics import topics, find_topic
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '../ext/velib_python'))
+from vedbus import VeDbusService
+
+
+def create_service(servicename: str, deviceinstance: int, on_value_changed: any, productname: str = 'Aquarea Heatpump',
+                   connection: str = 'RS485') -> VeDbusService:
+    # the heat pump as a Venus OS device, every topic at /Topic/<name>
+    service = VeDbusService(servicename)
+    logging.debug("%s /DeviceInstance = %d" % (servicename, deviceinstance))
+
+    # Create the management objects, as specified in the ccgx dbus-api document
+    service.add_path('/Mgmt/ProcessName', sys.argv[0])
+    service.add_path('/Mgmt/ProcessVersion', 'Unkown version, and running on Python ' + platform.python_version())
+    service.add_path('/Mgmt/Connection', connection)
+
+    # Create the mandatory objects
+    service.add_path('/DeviceInstance', deviceinstance)
+    service.add_path('/ProductId', 4711)
+    service.add_path('/ProductName', productname)
+    service.add_path('/FirmwareVersion', 0)
+    service.add_path('/HardwareVersion', 0)
+    service.add_path('/Connected', 1)
+
+    for topic in topics:
+        service.add_path(path=F"/Topic/{topic.name}", value=None,
+                         description=topic.help,
+                         writeable=topic.writable,
+                         onchangecallback=on_value_changed if topic.writable else None,
+                         gettextcallback=on_get_text)
+    return service
+
+
+def on_get_text(path: str, value):
+    topic = find_topic(path[7:]) if path.lower().startswith("/topic/") else None
+    if topic is not None:
+        return topic.description
+
+    return value